@@ -1,21 +1,43 @@
 import os
+import copy
 import json
 import time
+import stat
+import hashlib
+import tempfile
 import shlex
+import sqlite3
 import asyncio
 import subprocess
 import threading
+import atexit
+import queue
+import codecs
+import signal
+import logging
 from datetime import datetime
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from contextlib import contextmanager, ExitStack
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import secrets
 from dotenv import load_dotenv
+from lxd_client import LXDClient, LXDError, DEFAULT_SOCKET as DEFAULT_LXD_SOCKET
+from stats_history import StatsHistory, RESOLUTIONS as HISTORY_RESOLUTIONS
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single process only
+    fcntl = None
 
 # Load environment variables
 load_dotenv()
 
+# Background tasks log through app.logger, with one format for all of them
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', secrets.token_hex(32))
@@ -34,18 +56,79 @@ def date_filter(value, format='%Y'):
     except:
         return value
 
+@app.template_filter('ram')
+def ram_filter(ram_mb):
+    """Format a RAM size in MB, e.g. 8192 -> 8GB"""
+    if ram_mb % 1024 == 0:
+        return f"{ram_mb // 1024}GB"
+    return f"{ram_mb}MB"
+
+@app.template_filter('vps_config')
+def vps_config(vps):
+    """Summary line for a VPS, e.g. 8GB RAM / 4 CPU / 100GB Disk"""
+    return f"{ram_filter(vps['ram_mb'])} RAM / {vps['cpu']} CPU / {vps['disk_gb']}GB Disk"
+
 
 # Ensure upload directories exist
 os.makedirs('static/uploads/logos', exist_ok=True)
 os.makedirs('static/uploads/backgrounds', exist_ok=True)
 os.makedirs('static/uploads/payments', exist_ok=True)
 os.makedirs('data', exist_ok=True)
+os.makedirs('data/commands', exist_ok=True)
 
 # Configuration from environment
 DEFAULT_STORAGE_POOL = os.getenv('DEFAULT_STORAGE_POOL', 'default')
+LXD_SOCKET = os.getenv('LXD_SOCKET', DEFAULT_LXD_SOCKET)
+# Talk to LXD over its REST API when the socket exists, else use the lxc CLI
+LXD_API_ENABLED = os.getenv('LXD_API_ENABLED', 'true').lower() == 'true'
+# cgroup v2 directory of a container on the host, read for CPU/memory/IO stats
+CGROUP_ROOT = os.getenv('CGROUP_ROOT', '/sys/fs/cgroup')
+CGROUP_PATH_TEMPLATE = os.getenv('CGROUP_PATH_TEMPLATE', 'lxc.payload.{name}')
 CPU_THRESHOLD = int(os.getenv('CPU_THRESHOLD', 90))
 RAM_THRESHOLD = int(os.getenv('RAM_THRESHOLD', 90))
 CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', 600))
+# Seconds between background samples of container stats
+STATS_INTERVAL = int(os.getenv('STATS_INTERVAL', 10))
+# Seconds between samples of containers someone is watching over the stats stream
+STATS_STREAM_INTERVAL = float(os.getenv('STATS_STREAM_INTERVAL', 1))
+# Seconds a stats stream stays open; the browser then reconnects, so a
+# worker thread is never held by one page for longer than this
+STATS_STREAM_LIFETIME = int(os.getenv('STATS_STREAM_LIFETIME', 300))
+# Background job worker threads (provisioning, reinstall, resize, delete)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+# Finished jobs kept in data/jobs.json
+JOB_HISTORY = int(os.getenv('JOB_HISTORY', 200))
+# Admin commands streamed from containers: kept output (chars) and time limit
+COMMAND_OUTPUT_LIMIT = int(os.getenv('COMMAND_OUTPUT_LIMIT', 256 * 1024))
+COMMAND_TIMEOUT = int(os.getenv('COMMAND_TIMEOUT', 900))
+# Longest wait for a new tmate SSH session to connect
+SSH_READY_TIMEOUT = float(os.getenv('SSH_READY_TIMEOUT', 15))
+# Idle tmate sessions are killed after this many seconds (0 keeps them forever)
+SSH_SESSION_TTL = int(os.getenv('SSH_SESSION_TTL', 3600))
+# Seconds between writes of the stats history to disk
+HISTORY_SAVE_INTERVAL = int(os.getenv('HISTORY_SAVE_INTERVAL', 300))
+# Keep a never-booted snapshot of every new container (btrfs pools, and ZFS
+# pools with volume.zfs.use_refquota=true) so reinstalling the same OS is a
+# copy-on-write restore
+PRISTINE_SNAPSHOTS = os.getenv('PRISTINE_SNAPSHOTS', 'true').lower() == 'true'
+# Stopped, pre-initialized containers kept ready per OS for instant provisioning
+# (0 disables the pool), with per-OS overrides like "ubuntu2204:3,debian12:1"
+WARM_POOL_SIZE = int(os.getenv('WARM_POOL_SIZE', 0))
+WARM_POOL_SIZES = os.getenv('WARM_POOL_SIZES', '')
+# Seconds between warm pool top-ups (a provisioning wakes the filler early)
+WARM_POOL_INTERVAL = int(os.getenv('WARM_POOL_INTERVAL', 60))
+# OS keys ("all" or e.g. "ubuntu2204,debian12") cloned from a customized golden
+# container instead of the image, rebuilt every GOLDEN_REFRESH_INTERVAL seconds
+GOLDEN_CONTAINERS = os.getenv('GOLDEN_CONTAINERS', '')
+GOLDEN_REFRESH_INTERVAL = int(os.getenv('GOLDEN_REFRESH_INTERVAL', 86400))
+GOLDEN_SETUP_COMMAND = os.getenv('GOLDEN_SETUP_COMMAND',
+                                 'systemctl is-system-running --wait >/dev/null 2>&1; '
+                                 'export DEBIAN_FRONTEND=noninteractive; '
+                                 'apt-get update && apt-get -y upgrade && apt-get install -y tmate && apt-get clean')
+GOLDEN_SETUP_TIMEOUT = int(os.getenv('GOLDEN_SETUP_TIMEOUT', 1800))
+# Keep a local copy of every OS_OPTIONS image, refreshed every IMAGE_REFRESH_INTERVAL seconds
+IMAGE_CACHE_ENABLED = os.getenv('IMAGE_CACHE_ENABLED', 'true').lower() == 'true'
+IMAGE_REFRESH_INTERVAL = int(os.getenv('IMAGE_REFRESH_INTERVAL', 21600))
 cpu_monitor_active = True
 
 # Branding Configuration
@@ -82,8 +165,23 @@ OS_OPTIONS = {
 # Data files
 USERS_FILE = 'data/users.json'
 VPS_FILE = 'data/vps_data.json'
+VPS_JOURNAL_FILE = 'data/vps_data.journal'
 SETTINGS_FILE = 'data/settings.json'
 PENDING_PAYMENTS_FILE = 'data/pending_payments.json'
+JOBS_FILE = 'data/jobs.json'
+COMMANDS_FILE = 'data/commands.json'
+COMMANDS_DIR = 'data/commands'
+WARM_POOL_FILE = 'data/warm_pool.json'
+GOLDEN_FILE = 'data/golden.json'
+IMAGES_FILE = 'data/images.json'
+SSH_SESSIONS_FILE = 'data/ssh_sessions.json'
+STATS_HISTORY_FILE = 'data/stats_history.bin'
+
+# Storage backend: 'json' (data/*.json files) or 'sqlite'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+DATABASE_FILE = os.getenv('DATABASE_FILE', 'data/panel.db')
+# Journaled VPS changes are folded back into vps_data.json after this many entries
+VPS_JOURNAL_MAX_ENTRIES = int(os.getenv('VPS_JOURNAL_MAX_ENTRIES', 200))
 
 # VPS Plans
 VPS_PLANS = {
@@ -134,17 +232,511 @@ VPS_PLANS = {
     }
 }
 
+# Data File Locking
+# Every data file has a sidecar <file>.lock used for fcntl advisory locks so
+# several worker processes can share the data directory: shared locks for
+# reads, exclusive locks for writes and read-modify-write sequences. Locks are
+# re-entrant within a thread. Always take the file lock before
+# _data_cache_lock, and take every lock a transaction needs up front.
+_lock_state = threading.local()
+
+class ConcurrentUpdateError(Exception):
+    """Raised when saving data that another process changed since it was loaded"""
+
+@contextmanager
+def data_lock(path, exclusive=True):
+    """Hold a cross-process lock on a data file"""
+    held = _lock_state.__dict__.setdefault('held', {})
+    entry = held.get(path)
+    upgraded = False
+    if entry is None:
+        lock_file = None
+        if fcntl is not None:
+            lock_file = open(path + '.lock', 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        entry = held[path] = {'file': lock_file, 'exclusive': exclusive, 'depth': 0}
+    elif exclusive and not entry['exclusive']:
+        if fcntl is not None:
+            fcntl.flock(entry['file'], fcntl.LOCK_EX)
+        entry['exclusive'] = True
+        upgraded = True
+    entry['depth'] += 1
+    try:
+        yield
+    finally:
+        entry['depth'] -= 1
+        if upgraded:
+            if fcntl is not None:
+                fcntl.flock(entry['file'], fcntl.LOCK_SH)
+            entry['exclusive'] = False
+        if entry['depth'] == 0:
+            if fcntl is not None:
+                fcntl.flock(entry['file'], fcntl.LOCK_UN)
+                entry['file'].close()
+            del held[path]
+
+@contextmanager
+def data_transaction(*paths):
+    """Hold exclusive locks on several data files for a read-modify-write.
+
+    Loads inside the block see the latest data and nothing else can write
+    those files until it ends. They return a private copy: changes become
+    visible to other threads only when saved, and are dropped if the block
+    raises before that.
+    """
+    paths = sorted(set(paths))
+    with ExitStack() as stack:
+        for path in paths:
+            stack.enter_context(data_lock(path))
+        held = _lock_state.held
+        for path in paths:
+            held[path]['transactions'] = held[path].get('transactions', 0) + 1
+
+        def end():
+            for path in paths:
+                held[path]['transactions'] -= 1
+                if not held[path]['transactions']:
+                    held[path].pop('staged', None)
+
+        stack.callback(end)
+        yield
+
+# Data Cache
+# Parsed data files are kept in memory and only re-read when the file on disk
+# changed (e.g. written by another process). save_* functions make the saved
+# data the cached copy, so reads after a write never touch the disk. Each
+# entry also keeps a digest of the serialized content so saves that change
+# nothing are skipped.
+#
+# Cached data is copy-on-write: every reader shares it, so nothing may change
+# it in place. A data_transaction gets a private copy (staged on its lock)
+# that its save publishes as the new cached copy; single-record writers build
+# a new entry from shallow copies and publish it once it is persisted. A
+# failed write leaves the cached copy untouched. Don't change data after
+# saving it.
+#
+# Files are replaced atomically (temp file + fsync + rename) so a crash or a
+# concurrent reader never sees a half-written file. vps_data.json additionally
+# has an append-only journal: single-record changes (status flips etc.) are
+# appended to it and replayed on load, and the journal is folded back into the
+# snapshot once it grows past VPS_JOURNAL_MAX_ENTRIES.
+#
+# Lookup indexes registered in _CACHE_INDEXERS are rebuilt whenever a cache
+# entry is replaced and maintained in place by single-record changes.
+_data_cache = {}
+_data_cache_lock = threading.RLock()
+
+def _file_signature(path):
+    """Return (mtime, size, inode) for path, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _data_signature(path):
+    """Signature of everything a data file is loaded from, or None if it does not exist"""
+    signature = _file_signature(path)
+    if signature is None:
+        return None
+    if path in _JOURNALS:
+        return (signature, _file_signature(_JOURNALS[path][0]))
+    return signature
+
+def _publish(path, entry):
+    """Make entry the cached copy of path. The previous entry is left as it was
+    for the readers still holding it."""
+    _data_cache[path] = entry
+    lock = getattr(_lock_state, 'held', {}).get(path)
+    if lock is not None:
+        # Later loads in this transaction copy the published data
+        lock.pop('staged', None)
+    return entry
+
+def _cache_put(path, entry):
+    """Store a cache entry, building the lookup index registered for path"""
+    indexer = _CACHE_INDEXERS.get(path)
+    entry['index'] = indexer(entry['data']) if indexer is not None else None
+    return _publish(path, entry)
+
+def _stage(path, entry):
+    """The data of a cache entry as the caller may use it: the shared copy for
+    readers, a private copy (with its index) inside a data_transaction"""
+    lock = getattr(_lock_state, 'held', {}).get(path)
+    if lock is None or not lock.get('transactions'):
+        return entry['data']
+    if lock.get('staged') is None:
+        data, index = copy.deepcopy((entry['data'], entry.get('index')))
+        lock['staged'] = dict(entry, data=data, index=index)
+    return lock['staged']['data']
+
+def _current_entry(path):
+    """The cache entry this thread sees: its transaction's copy, or the shared one"""
+    lock = getattr(_lock_state, 'held', {}).get(path)
+    if lock is not None and lock.get('staged') is not None:
+        return lock['staged']
+    return _data_cache.get(path)
+
+def _content_digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def _atomic_write(path, text):
+    """Replace path with text via a temp file, fsync and rename"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # Persist the rename itself (not supported on every platform)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+def _replay_journal(path, cached):
+    """Apply journal entries for path to a cache entry. Returns the number applied."""
+    journal_file, apply_entry = _JOURNALS[path]
+    try:
+        f = open(journal_file, 'r')
+    except FileNotFoundError:
+        return 0
+    count = 0
+    with f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn write from a crash mid-append
+                continue
+            apply_entry(cached, entry)
+            count += 1
+    return count
+
+def _journal_append(path, entry, cached):
+    """Append a change for path to its journal instead of rewriting the file,
+    then publish `cached`, the cache entry with the change applied"""
+    journal_file = _JOURNALS[path][0]
+    with data_lock(path), _data_cache_lock:
+        with open(journal_file, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        cached = _publish(path, dict(cached, signature=_data_signature(path), digest=None,
+                                     journal_entries=cached.get('journal_entries', 0) + 1))
+        if cached['journal_entries'] >= VPS_JOURNAL_MAX_ENTRIES:
+            _save_json_cached(path, cached['data'])
+
+def _load_json_cached(path):
+    """Load JSON from path, reusing the cached copy while the file is unchanged"""
+    signature = _data_signature(path)
+    with _data_cache_lock:
+        entry = _data_cache.get(path)
+        if entry is not None and signature is not None and entry['signature'] == signature:
+            return _stage(path, entry)
+    with data_lock(path, exclusive=False), _data_cache_lock:
+        signature = _data_signature(path)
+        entry = _data_cache.get(path)
+        if entry is not None and signature is not None and entry['signature'] == signature:
+            return _stage(path, entry)
+        with open(path, 'r') as f:
+            text = f.read()
+        entry = {
+            'signature': signature,
+            'digest': _content_digest(text),
+            'data': json.loads(text),
+            'journal_entries': 0
+        }
+        indexer = _CACHE_INDEXERS.get(path)
+        entry['index'] = indexer(entry['data']) if indexer is not None else None
+        if path in _JOURNALS:
+            # Not published yet, so the journal can be applied in place
+            entry['journal_entries'] = _replay_journal(path, entry)
+            if entry['journal_entries']:
+                # The snapshot alone no longer matches data
+                entry['digest'] = None
+        return _stage(path, _publish(path, entry))
+
+def _save_json_cached(path, data):
+    """Write data to path and make it the cached copy.
+
+    Returns False without touching the disk when the serialized content is
+    identical to what the file already holds.
+    """
+    text = json.dumps(data, indent=4)
+    digest = _content_digest(text)
+    with data_lock(path), _data_cache_lock:
+        entry = _data_cache.get(path)
+        signature = _data_signature(path)
+        if entry is not None and entry['data'] is data and entry['signature'] != signature:
+            raise ConcurrentUpdateError(f"{path} was changed by another process")
+        if (entry is not None and entry['digest'] == digest
+                and entry['signature'] == signature):
+            if entry['data'] is not data:
+                _cache_put(path, dict(entry, data=data))
+            return False
+        _atomic_write(path, text)
+        if path in _JOURNALS:
+            # Everything journaled so far is part of the new snapshot
+            try:
+                os.remove(_JOURNALS[path][0])
+            except FileNotFoundError:
+                pass
+        _cache_put(path, {
+            'signature': _data_signature(path),
+            'digest': digest,
+            'data': data,
+            'journal_entries': 0
+        })
+        return True
+
+# SQLite Storage Backend
+# With STORAGE_BACKEND=sqlite the users, VPS and payment stores live in one
+# SQLite database (WAL mode) instead of JSON files. Each record is a row keyed
+# by its natural id, the fields we look records up by are indexed columns and
+# the full record is kept as JSON. A per-table version in `meta` is bumped on
+# every write and serves as the cache signature, like mtime does for files.
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    email TEXT,
+    role TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
+CREATE TABLE IF NOT EXISTS vps (
+    container_name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_vps_owner ON vps(owner);
+CREATE TABLE IF NOT EXISTS payments (
+    buy_id TEXT PRIMARY KEY,
+    user TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status);
+"""
+
+# data file -> (table, key column, indexed columns)
+_SQLITE_TABLES = {
+    USERS_FILE: ('users', 'username', ('email', 'role')),
+    VPS_FILE: ('vps', 'container_name', ('owner', 'position')),
+    PENDING_PAYMENTS_FILE: ('payments', 'buy_id', ('user', 'status'))
+}
+
+_sqlite_local = threading.local()
+
+def _sqlite_conn():
+    """Return this thread's database connection"""
+    conn = getattr(_sqlite_local, 'conn', None)
+    if conn is None or _sqlite_local.pid != os.getpid():
+        # A forked worker must not share its parent's connection
+        conn = sqlite3.connect(DATABASE_FILE, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SQLITE_SCHEMA)
+        _sqlite_local.conn = conn
+        _sqlite_local.pid = os.getpid()
+    return conn
+
+@contextmanager
+def _sqlite_transaction(conn, mode='IMMEDIATE'):
+    conn.execute(f'BEGIN {mode}')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def _sqlite_version(conn, table):
+    row = conn.execute('SELECT version FROM meta WHERE name = ?', (table,)).fetchone()
+    return row[0] if row else None
+
+def _sqlite_bump_version(conn, table):
+    conn.execute(
+        'INSERT INTO meta (name, version) VALUES (?, 1) '
+        'ON CONFLICT(name) DO UPDATE SET version = version + 1',
+        (table,)
+    )
+    return _sqlite_version(conn, table)
+
+def _sqlite_rows(path, data):
+    """Flatten a loaded store into {key: (column values, record json)}"""
+    if path == VPS_FILE:
+        rows = {}
+        for owner, vps_list in data.items():
+            for position, vps in enumerate(vps_list):
+                rows[vps['container_name']] = ((owner, position), json.dumps(vps))
+        return rows
+    columns = _SQLITE_TABLES[path][2]
+    return {
+        key: (tuple(record.get(c) for c in columns), json.dumps(record))
+        for key, record in data.items()
+    }
+
+def _sqlite_fetch_rows(conn, path):
+    table, key_column, columns = _SQLITE_TABLES[path]
+    order = ' ORDER BY owner, position' if path == VPS_FILE else ''
+    cursor = conn.execute(f"SELECT {key_column}, {', '.join(columns)}, data FROM {table}{order}")
+    return {row[0]: (tuple(row[1:-1]), row[-1]) for row in cursor}
+
+def _sqlite_load(path):
+    """Load a store from the database, reusing the cached copy while its version is unchanged"""
+    table = _SQLITE_TABLES[path][0]
+    conn = _sqlite_conn()
+    with _data_cache_lock:
+        with _sqlite_transaction(conn, 'DEFERRED'):
+            version = _sqlite_version(conn, table)
+            if version is None:
+                # Never written, same as a missing data file
+                raise FileNotFoundError(table)
+            entry = _data_cache.get(path)
+            if entry is not None and entry['signature'] == version:
+                return _stage(path, entry)
+            rows = _sqlite_fetch_rows(conn, path)
+        data = {}
+        for key, (values, text) in rows.items():
+            record = json.loads(text)
+            if path == VPS_FILE:
+                data.setdefault(values[0], []).append(record)
+            else:
+                data[key] = record
+        return _stage(path, _cache_put(path, {'signature': version, 'rows': rows, 'data': data}))
+
+def _sqlite_save(path, data):
+    """Write only the rows of a store that differ from what the database holds"""
+    table, key_column, columns = _SQLITE_TABLES[path]
+    rows = _sqlite_rows(path, data)
+    conn = _sqlite_conn()
+    with data_lock(path), _data_cache_lock:
+        with _sqlite_transaction(conn):
+            version = _sqlite_version(conn, table)
+            entry = _data_cache.get(path)
+            if entry is not None and entry['data'] is data and entry['signature'] != version:
+                raise ConcurrentUpdateError(f"{table} was changed by another process")
+            if entry is not None and version is not None and entry['signature'] == version:
+                current = entry['rows']
+            else:
+                current = _sqlite_fetch_rows(conn, path)
+            changed = [(key,) + values + (text,) for key, (values, text) in rows.items()
+                       if current.get(key) != (values, text)]
+            removed = [(key,) for key in current if key not in rows]
+            if changed or removed or version is None:
+                placeholders = ', '.join('?' * (len(columns) + 2))
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} ({key_column}, {', '.join(columns)}, data) "
+                    f"VALUES ({placeholders})",
+                    changed
+                )
+                conn.executemany(f'DELETE FROM {table} WHERE {key_column} = ?', removed)
+                version = _sqlite_bump_version(conn, table)
+        _cache_put(path, {'signature': version, 'rows': rows, 'data': data})
+        return bool(changed or removed)
+
+def _sqlite_put_row(path, key, record, cached, values=None):
+    """Insert or replace a single record, then publish `cached`, the cache entry
+    holding it. values defaults to the record's own indexed fields."""
+    table, key_column, columns = _SQLITE_TABLES[path]
+    if values is None:
+        values = tuple(record.get(c) for c in columns)
+    text = json.dumps(record)
+    conn = _sqlite_conn()
+    with data_lock(path), _data_cache_lock:
+        with _sqlite_transaction(conn):
+            previous = _sqlite_version(conn, table)
+            placeholders = ', '.join('?' * (len(columns) + 2))
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table} ({key_column}, {', '.join(columns)}, data) "
+                f"VALUES ({placeholders})",
+                (key,) + values + (text,)
+            )
+            version = _sqlite_bump_version(conn, table)
+        entry = _data_cache.get(path)
+        if entry is not None and entry['signature'] == previous:
+            rows = dict(entry['rows'])
+            rows[key] = (values, text)
+            _publish(path, dict(cached, signature=version, rows=rows))
+        else:
+            _data_cache.pop(path, None)
+
+def _sqlite_delete_row(path, key, cached):
+    table, key_column, _ = _SQLITE_TABLES[path]
+    conn = _sqlite_conn()
+    with data_lock(path), _data_cache_lock:
+        with _sqlite_transaction(conn):
+            previous = _sqlite_version(conn, table)
+            conn.execute(f'DELETE FROM {table} WHERE {key_column} = ?', (key,))
+            version = _sqlite_bump_version(conn, table)
+        entry = _data_cache.get(path)
+        if entry is not None and entry['signature'] == previous:
+            rows = dict(entry['rows'])
+            rows.pop(key, None)
+            _publish(path, dict(cached, signature=version, rows=rows))
+        else:
+            _data_cache.pop(path, None)
+
+def import_json_to_sqlite():
+    """One-shot import of the existing data/*.json files into the database"""
+    imported = []
+    with data_transaction(*_SQLITE_TABLES):
+        for path in _SQLITE_TABLES:
+            try:
+                # Through the JSON cache so journaled VPS changes are included
+                data = _load_json_cached(path)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            _sqlite_save(path, data)
+            imported.append(path)
+    return imported
+
+def _load_store(path):
+    if STORAGE_BACKEND == 'sqlite' and path in _SQLITE_TABLES:
+        return _sqlite_load(path)
+    return _load_json_cached(path)
+
+def _save_store(path, data):
+    if STORAGE_BACKEND == 'sqlite' and path in _SQLITE_TABLES:
+        return _sqlite_save(path, data)
+    return _save_json_cached(path, data)
+
+def _put_record(path, cached, key):
+    """Persist one record of a new cache entry (alone where the backend allows
+    it) and publish the entry"""
+    if STORAGE_BACKEND == 'sqlite':
+        _sqlite_put_row(path, key, cached['data'][key], cached)
+    else:
+        _save_json_cached(path, cached['data'])
+
 # Data Loading Functions
 def load_users():
     try:
-        with open(USERS_FILE, 'r') as f:
-            users = json.load(f)
-            # Ensure balance exists for all users
-            for u in users.values():
-                if 'balance' not in u:
-                    u['balance'] = 0.0
-            save_users(users)
-            return users
+        return _load_store(USERS_FILE)
     except (FileNotFoundError, json.JSONDecodeError):
         default_users = {
             "admin": {
@@ -163,24 +755,261 @@ def load_users():
         return default_users
 
 def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
+    return _save_store(USERS_FILE, users)
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+# Fields whose change must take effect on sessions that are already logged in
+AUTH_FIELDS = ('role', 'banned', 'suspended')
+
+def _auth_state(user):
+    return {
+        'role': user.get('role', 'user'),
+        'banned': bool(user.get('banned')),
+        'suspended': bool(user.get('suspended')),
+        'version': user.get('auth_version', 0)
+    }
+
+def _build_user_index(users):
+    """Index usernames by normalized email, and account state for the auth decorators"""
+    by_email = {}
+    auth = {}
+    for username, user in users.items():
+        by_email.setdefault(normalize_email(user.get('email')), username)
+        auth[username] = _auth_state(user)
+    return {'by_email': by_email, 'auth': auth}
+
+def _user_index():
+    load_users()
+    with _data_cache_lock:
+        return _current_entry(USERS_FILE)['index']
+
+def find_user_by_email(email):
+    """Return the username registered with email, or None"""
+    return _user_index()['by_email'].get(normalize_email(email))
+
+def get_auth_state(username):
+    """Return role, banned, suspended and auth version for username, or None if it does not exist"""
+    return _user_index()['auth'].get(username)
+
+def email_taken(email, exclude_username=None):
+    owner = find_user_by_email(email)
+    return owner is not None and owner != exclude_username
+
+def add_user(username, user):
+    """Add a user record. Returns False if the username already exists."""
+    with data_lock(USERS_FILE), _data_cache_lock:
+        load_users()
+        cached = _data_cache[USERS_FILE]
+        if username in cached['data']:
+            return False
+        users = {**cached['data'], username: user}
+        by_email = dict(cached['index']['by_email'])
+        by_email.setdefault(normalize_email(user.get('email')), username)
+        auth = {**cached['index']['auth'], username: _auth_state(user)}
+        _put_record(USERS_FILE, dict(cached, data=users, index={'by_email': by_email, 'auth': auth}),
+                    username)
+        return True
+
+def update_user(username, **fields):
+    """Set fields on a single user. Returns False if the user does not exist."""
+    with data_lock(USERS_FILE), _data_cache_lock:
+        load_users()
+        cached = _data_cache[USERS_FILE]
+        if username not in cached['data']:
+            return False
+        user = cached['data'][username]
+        by_email = cached['index']['by_email']
+        if 'email' in fields:
+            by_email = dict(by_email)
+            old_email = normalize_email(user.get('email'))
+            if by_email.get(old_email) == username:
+                del by_email[old_email]
+            by_email.setdefault(normalize_email(fields['email']), username)
+        if any(field in fields and fields[field] != user.get(field) for field in AUTH_FIELDS):
+            # Invalidates the cached role/state of this user's sessions
+            fields = dict(fields, auth_version=user.get('auth_version', 0) + 1)
+        user = dict(user, **fields)
+        users = {**cached['data'], username: user}
+        auth = {**cached['index']['auth'], username: _auth_state(user)}
+        _put_record(USERS_FILE, dict(cached, data=users, index={'by_email': by_email, 'auth': auth}),
+                    username)
+        return True
 
 def load_vps_data():
     try:
-        with open(VPS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+        return _load_store(VPS_FILE)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        # Never hand back an empty fleet for a damaged file, the next save
+        # would wipe every record. Serve the last good copy if we have one,
+        # otherwise set the damaged file aside for recovery.
+        with _data_cache_lock:
+            entry = _data_cache.get(VPS_FILE)
+            if entry is not None:
+                return _stage(VPS_FILE, entry)
+        corrupt_path = f"{VPS_FILE}.corrupt-{int(time.time())}"
+        os.replace(VPS_FILE, corrupt_path)
+        app.logger.warning("%s could not be parsed and was moved to %s", VPS_FILE, corrupt_path)
         return {}
 
 def save_vps_data(data):
-    with open(VPS_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    return _save_store(VPS_FILE, data)
+
+def _vps_resources(vps):
+    """Return what a VPS record contributes to the resource totals"""
+    # Records that predate the typed fields count as zero until migrate_data() runs
+    return {
+        'vps': 1,
+        'ram_mb': vps.get('ram_mb', 0),
+        'cpu': int(vps.get('cpu', 0)),
+        'disk_gb': vps.get('disk_gb', 0),
+        'running': 1 if vps.get('status') == 'running' and not vps.get('suspended') else 0
+    }
+
+def _empty_totals():
+    return {'vps': 0, 'ram_mb': 0, 'cpu': 0, 'disk_gb': 0, 'running': 0}
+
+def _count_vps(index, owner, vps, sign):
+    """Add (sign=1) or remove (sign=-1) a record from the running totals"""
+    user_totals = index['user_totals'].setdefault(owner, _empty_totals())
+    for key, value in _vps_resources(vps).items():
+        index['totals'][key] += sign * value
+        user_totals[key] += sign * value
+
+def _build_vps_index(vps_data):
+    """Index VPS records by container name and by owner, with resource totals"""
+    index = {'by_name': {}, 'by_owner': {}, 'totals': _empty_totals(), 'user_totals': {}}
+    for owner, vps_list in vps_data.items():
+        index['by_owner'][owner] = [vps['container_name'] for vps in vps_list]
+        index['user_totals'][owner] = _empty_totals()
+        for vps in vps_list:
+            index['by_name'][vps['container_name']] = (owner, vps)
+            _count_vps(index, owner, vps, 1)
+    return index
+
+def _vps_index():
+    load_vps_data()
+    with _data_cache_lock:
+        entry = _current_entry(VPS_FILE)
+        if entry is None:
+            return _build_vps_index({})
+        return entry['index']
+
+def find_vps(container_name):
+    """Return (owner, vps record) for a container, or (None, None)"""
+    return _vps_index()['by_name'].get(container_name, (None, None))
+
+def get_user_containers(username):
+    """Return the container names owned by username"""
+    return list(_vps_index()['by_owner'].get(username, []))
+
+def get_vps_totals(username=None):
+    """Return VPS count, RAM (MB), disk (GB), CPU cores and running count, fleet-wide or for one user"""
+    index = _vps_index()
+    if username is None:
+        return dict(index['totals'])
+    return dict(index['user_totals'].get(username, _empty_totals()))
+
+def _copy_vps_entry(cached, owner):
+    """Copy of a VPS cache entry in which _apply_vps_change may change owner's
+    records, their index and the totals without touching the original"""
+    data = dict(cached['data'])
+    data[owner] = [dict(vps) for vps in data.get(owner, [])]
+    index = cached['index']
+    by_name = dict(index['by_name'])
+    for vps in data[owner]:
+        by_name[vps['container_name']] = (owner, vps)
+    by_owner = dict(index['by_owner'])
+    by_owner[owner] = list(by_owner.get(owner, []))
+    user_totals = dict(index['user_totals'])
+    user_totals[owner] = dict(user_totals.get(owner) or _empty_totals())
+    return dict(cached, data=data, index={
+        'by_name': by_name,
+        'by_owner': by_owner,
+        'totals': dict(index['totals']),
+        'user_totals': user_totals
+    })
+
+def _apply_vps_change(cached, change):
+    """Apply a single-record change in place to VPS data and its index"""
+    vps_data = cached['data']
+    index = cached['index']
+    container_name = change['container_name']
+    if change['op'] == 'update':
+        found = index['by_name'].get(container_name)
+        if found is not None:
+            owner, vps = found
+            _count_vps(index, owner, vps, -1)
+            vps.update(change['fields'])
+            _count_vps(index, owner, vps, 1)
+    elif change['op'] == 'add':
+        if container_name in index['by_name']:
+            # Already part of the snapshot
+            return
+        owner, vps = change['owner'], change['vps']
+        vps_data.setdefault(owner, []).append(vps)
+        index['by_name'][container_name] = (owner, vps)
+        index['by_owner'].setdefault(owner, []).append(container_name)
+        _count_vps(index, owner, vps, 1)
+    elif change['op'] == 'remove':
+        found = index['by_name'].pop(container_name, None)
+        if found is not None:
+            owner, vps = found
+            user_vps = vps_data[owner]
+            for i, v in enumerate(user_vps):
+                if v is vps:
+                    del user_vps[i]
+                    break
+            index['by_owner'][owner].remove(container_name)
+            _count_vps(index, owner, vps, -1)
+
+def _commit_vps_change(change):
+    """Apply a single-record VPS change and persist just that record.
+
+    With the JSON backend the change is appended to the VPS journal rather
+    than rewriting vps_data.json.
+    """
+    with data_lock(VPS_FILE), _data_cache_lock:
+        load_vps_data()
+        cached = _data_cache.get(VPS_FILE)
+        if cached is None:
+            save_vps_data({})
+            cached = _data_cache[VPS_FILE]
+        container_name = change['container_name']
+        found = cached['index']['by_name'].get(container_name)
+        if (found is None) == (change['op'] != 'add'):
+            return False
+        owner = change['owner'] if found is None else found[0]
+        cached = _copy_vps_entry(cached, owner)
+        _apply_vps_change(cached, change)
+        if STORAGE_BACKEND != 'sqlite':
+            _journal_append(VPS_FILE, change, cached)
+        elif change['op'] == 'remove':
+            _sqlite_delete_row(VPS_FILE, container_name, cached)
+        else:
+            _, vps = cached['index']['by_name'][container_name]
+            position = next(i for i, v in enumerate(cached['data'][owner]) if v is vps)
+            _sqlite_put_row(VPS_FILE, container_name, vps, cached, (owner, position))
+        return True
+
+def update_vps(container_name, **fields):
+    """Set fields on a single VPS record. Returns False if it does not exist."""
+    return _commit_vps_change({'op': 'update', 'container_name': container_name, 'fields': fields})
+
+def add_vps(owner, vps):
+    """Add a VPS record for owner. Returns False if the container name is taken."""
+    return _commit_vps_change({'op': 'add', 'container_name': vps['container_name'], 'owner': owner, 'vps': vps})
+
+def remove_vps(container_name):
+    """Remove a VPS record. Returns False if it does not exist."""
+    return _commit_vps_change({'op': 'remove', 'container_name': container_name})
 
 def load_settings():
     try:
-        with open(SETTINGS_FILE, 'r') as f:
-            return json.load(f)
+        return _load_json_cached(SETTINGS_FILE)
     except (FileNotFoundError, json.JSONDecodeError):
         default_settings = {
             "logo": None,
@@ -192,21 +1021,111 @@ def load_settings():
         return default_settings
 
 def save_settings(settings):
-    with open(SETTINGS_FILE, 'w') as f:
-        json.dump(settings, f, indent=4)
+    return _save_json_cached(SETTINGS_FILE, settings)
 
 def load_pending_payments():
     try:
-        with open(PENDING_PAYMENTS_FILE, 'r') as f:
-            return json.load(f)
+        return _load_store(PENDING_PAYMENTS_FILE)
     except (FileNotFoundError, json.JSONDecodeError):
         return {}
 
 def save_pending_payments(data):
-    with open(PENDING_PAYMENTS_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    return _save_store(PENDING_PAYMENTS_FILE, data)
+
+def update_payment(buy_id, **fields):
+    """Set fields on a single pending payment. Returns False if it does not exist."""
+    with data_lock(PENDING_PAYMENTS_FILE), _data_cache_lock:
+        load_pending_payments()
+        cached = _data_cache.get(PENDING_PAYMENTS_FILE)
+        if cached is None or buy_id not in cached['data']:
+            return False
+        payment = cached['data'][buy_id]
+        by_status = dict(cached['index']['by_status'])
+        if 'status' in fields:
+            by_status[payment['status']] -= 1
+            by_status[fields['status']] = by_status.get(fields['status'], 0) + 1
+        pending_payments = {**cached['data'], buy_id: dict(payment, **fields)}
+        _put_record(PENDING_PAYMENTS_FILE,
+                    dict(cached, data=pending_payments, index={'by_status': by_status}), buy_id)
+        return True
+
+def _build_payment_index(pending_payments):
+    """Count payments by status"""
+    by_status = {}
+    for payment in pending_payments.values():
+        by_status[payment['status']] = by_status.get(payment['status'], 0) + 1
+    return {'by_status': by_status}
+
+def count_payments(status):
+    load_pending_payments()
+    with _data_cache_lock:
+        entry = _current_entry(PENDING_PAYMENTS_FILE)
+        if entry is None:
+            return 0
+        return entry['index']['by_status'].get(status, 0)
+
+# data file -> (journal file, entry applier)
+_JOURNALS = {
+    VPS_FILE: (VPS_JOURNAL_FILE, _apply_vps_change)
+}
+
+# data file -> lookup index builder
+_CACHE_INDEXERS = {
+    USERS_FILE: _build_user_index,
+    VPS_FILE: _build_vps_index,
+    PENDING_PAYMENTS_FILE: _build_payment_index
+}
+
+# Data Migrations
+def migrate_data():
+    """Bring stored records up to the current schema. Runs once at startup."""
+    with data_transaction(USERS_FILE, VPS_FILE, PENDING_PAYMENTS_FILE):
+        _migrate_data()
+
+def _migrate_data():
+    if STORAGE_BACKEND == 'sqlite' and _sqlite_version(_sqlite_conn(), 'users') is None:
+        import_json_to_sqlite()
+    
+    users = load_users()
+    changed = False
+    for u in users.values():
+        # Ensure balance exists for all users
+        if 'balance' not in u:
+            u['balance'] = 0.0
+            changed = True
+    if changed:
+        save_users(users)
+    
+    # Fold any VPS journal left over from the last run into the snapshot
+    if STORAGE_BACKEND != 'sqlite' and os.path.exists(VPS_JOURNAL_FILE):
+        _save_json_cached(VPS_FILE, load_vps_data())
+    
+    vps_data = load_vps_data()
+    changed = False
+    for vps_list in vps_data.values():
+        for vps in vps_list:
+            changed = _migrate_vps_resources(vps) or changed
+    if changed:
+        save_vps_data(vps_data)
+
+def _parse_gb(value):
+    return int(str(value).upper().replace('GB', '').strip() or 0)
+
+def _migrate_vps_resources(vps):
+    """Replace the old '8GB' / '4' string resource fields with ram_mb, disk_gb and an int cpu"""
+    if 'ram_mb' in vps and 'disk_gb' in vps and isinstance(vps.get('cpu'), int):
+        return False
+    if 'ram_mb' not in vps:
+        vps['ram_mb'] = _parse_gb(vps.get('ram', 0)) * 1024
+    if 'disk_gb' not in vps:
+        vps['disk_gb'] = _parse_gb(vps.get('storage', 0))
+    vps['cpu'] = int(vps.get('cpu', 0))
+    for legacy_field in ('ram', 'storage', 'config'):
+        vps.pop(legacy_field, None)
+    return True
 
 # Initialize data
+migrate_data()
 users = load_users()
 vps_data = load_vps_data()
 settings = load_settings()
@@ -232,9 +1151,308 @@ def execute_lxc_sync(command, timeout=120):
     except Exception as e:
         raise Exception(str(e))
 
+# LXD API
+# Container operations go through the LXD REST API on LXD_SOCKET, using one
+# kept-alive connection per thread instead of spawning the lxc CLI for every
+# call. The CLI is still used when the socket is not available.
+lxd = LXDClient(LXD_SOCKET)
+
+def use_lxd_api():
+    return LXD_API_ENABLED and lxd.available()
+
+def lxc_set_state(container_name, action, force=False):
+    """Start, stop or restart a container"""
+    try:
+        if use_lxd_api():
+            lxd.change_state(container_name, action, force=force)
+            return True
+        return execute_lxc_sync(f"lxc {action} {container_name}" + (" --force" if force else ""))
+    finally:
+        invalidate_container_stats(container_name)
+
+def lxc_set_limits(container_name, ram_mb, cpu, disk_gb, config=None):
+    """Apply memory, CPU and root disk limits (and extra config keys) to a container"""
+    config = dict(config or {})
+    if use_lxd_api():
+        instance = lxd.get(container_name)
+        root = dict(instance.get('expanded_devices', {}).get('root') or
+                    {'type': 'disk', 'path': '/', 'pool': DEFAULT_STORAGE_POOL})
+        root['size'] = f"{disk_gb}GB"
+        config.update({
+            'limits.memory': f"{ram_mb}MB",
+            'limits.cpu': str(cpu)
+        })
+        lxd.update(container_name, config=config, devices={'root': root})
+        return True
+    execute_lxc_sync(f"lxc config set {container_name} limits.memory {ram_mb}MB")
+    execute_lxc_sync(f"lxc config set {container_name} limits.cpu {cpu}")
+    execute_lxc_sync(f"lxc config device set {container_name} root size {disk_gb}GB")
+    for key, value in config.items():
+        execute_lxc_sync(f"lxc config set {container_name} {key} {value}")
+    return True
+
+# Image servers behind the lxc CLI's default remotes, for creating over the API
+IMAGE_REMOTES = {
+    'ubuntu': 'https://cloud-images.ubuntu.com/releases',
+    'ubuntu-daily': 'https://cloud-images.ubuntu.com/daily',
+    'images': 'https://images.linuxcontainers.org'
+}
+
+def _image_source(os_image):
+    """LXD API image source for a remote:alias image, None for unknown remotes"""
+    remote, _, alias = os_image.rpartition(':')
+    if not remote:
+        return {'type': 'image', 'alias': alias}
+    server = IMAGE_REMOTES.get(remote)
+    if server is None:
+        return None
+    return {'type': 'image', 'alias': alias, 'server': server, 'protocol': 'simplestreams', 'mode': 'pull'}
+
+def _create_options(ram_mb, cpu, disk_gb):
+    """Limits config, root disk device and the matching lxc CLI -c/-d options"""
+    config = {}
+    if ram_mb is not None:
+        config['limits.memory'] = f"{ram_mb}MB"
+    if cpu is not None:
+        config['limits.cpu'] = str(cpu)
+    root = {'type': 'disk', 'path': '/', 'pool': DEFAULT_STORAGE_POOL}
+    options = f" --storage {DEFAULT_STORAGE_POOL}"
+    options += ''.join(f" -c {key}={value}" for key, value in config.items())
+    if disk_gb is not None:
+        root['size'] = f"{disk_gb}GB"
+        options += f" -d root,size={disk_gb}GB"
+    return config, root, options
+
+def lxc_create(container_name, os_image, ram_mb=None, cpu=None, disk_gb=None, start=False, timeout=120):
+    """Create a container with its limits and root disk size in one request.
+
+    Nothing is applied afterwards, so with start=True the container comes up
+    with its final configuration. Uses one API call, or one `lxc init/launch`
+    with -c/-d options.
+    """
+    config, root, options = _create_options(ram_mb, cpu, disk_gb)
+    source = _image_source(os_image)
+    try:
+        if use_lxd_api() and source is not None:
+            lxd.create(container_name, source, config=config, devices={'root': root},
+                       start=start, timeout=timeout)
+            return True
+        return execute_lxc_sync(f"lxc {'launch' if start else 'init'} {os_image} {container_name}{options}",
+                                timeout=timeout)
+    finally:
+        if start:
+            invalidate_container_stats(container_name)
+
+def lxc_clone(source_name, container_name, ram_mb=None, cpu=None, disk_gb=None, start=False, timeout=300):
+    """Copy a stopped container (without its snapshots) into a new one with its limits.
+
+    On zfs/btrfs pools the copy is a snapshot clone sharing blocks with the
+    source. Over the API it is one request; the CLI needs a separate start.
+    """
+    config, root, options = _create_options(ram_mb, cpu, disk_gb)
+    try:
+        if use_lxd_api():
+            lxd.create(container_name, {'type': 'copy', 'source': source_name, 'instance_only': True},
+                       config=config, devices={'root': root}, start=start, timeout=timeout)
+            return True
+        execute_lxc_sync(f"lxc copy {source_name} {container_name} --instance-only{options}",
+                         timeout=timeout)
+        if start:
+            execute_lxc_sync(f"lxc start {container_name}")
+        return True
+    finally:
+        if start:
+            invalidate_container_stats(container_name)
+
+def lxc_delete(container_name):
+    """Delete a container and its snapshots, stopping it first if it runs"""
+    try:
+        if use_lxd_api():
+            if lxd.status(container_name) != 'Stopped':
+                lxd.stop(container_name, force=True)
+            lxd.delete(container_name)
+            return True
+        return execute_lxc_sync(f"lxc delete {container_name} --force")
+    finally:
+        invalidate_container_stats(container_name)
+
+def discard_container(container_name):
+    """Force-delete a container that may not exist, ignoring errors"""
+    try:
+        lxc_delete(container_name)
+    except Exception:
+        pass
+
+def lxc_rename(container_name, new_name):
+    """Rename a stopped container"""
+    if use_lxd_api():
+        lxd.rename(container_name, new_name)
+        return True
+    return execute_lxc_sync(f"lxc move {container_name} {new_name}")
+
+# Snapshots
+# On copy-on-write pools every new container gets a snapshot taken before its
+# first boot. Reinstalling the same OS restores it instead of deleting and
+# re-creating the container, which takes seconds and keeps the container's
+# identity (name, MAC, volatile keys). Only the blocks the customer changed
+# are stored twice; on other pools a snapshot is a full copy, so none is taken.
+# ZFS counts snapshots against a volume's quota unless the pool sets
+# volume.zfs.use_refquota=true, so without it the customer would lose disk
+# space to the snapshot and none is taken either.
+COW_STORAGE_DRIVERS = ('zfs', 'btrfs')
+_storage_pools = {}
+
+def storage_pool(pool=DEFAULT_STORAGE_POOL):
+    """Definition of a storage pool (driver, config...), None if unknown"""
+    if pool not in _storage_pools:
+        try:
+            if use_lxd_api():
+                definition = lxd.storage_pool(pool)
+            else:
+                definition = json.loads(execute_lxc_sync(f"lxc query /1.0/storage-pools/{pool}"))
+        except Exception as e:
+            app.logger.warning("Could not read storage pool %s: %s", pool, e)
+            return None
+        _storage_pools[pool] = definition
+    return _storage_pools[pool]
+
+def storage_pool_driver(pool=DEFAULT_STORAGE_POOL):
+    """Storage driver of a pool (zfs, btrfs, dir...), None if unknown"""
+    return (storage_pool(pool) or {}).get('driver')
+
+def pristine_snapshots_enabled():
+    if not PRISTINE_SNAPSHOTS:
+        return False
+    pool = storage_pool() or {}
+    if pool.get('driver') == 'zfs':
+        return (pool.get('config') or {}).get('volume.zfs.use_refquota') == 'true'
+    return pool.get('driver') in COW_STORAGE_DRIVERS
+
+def pristine_snapshot_name(os_key):
+    return f"pristine-{os_key}"
+
+def lxc_snapshots(container_name):
+    """Names of a container's snapshots"""
+    if use_lxd_api():
+        return lxd.snapshots(container_name)
+    urls = json.loads(execute_lxc_sync(f"lxc query /1.0/instances/{container_name}/snapshots"))
+    return [url.rsplit('/', 1)[-1] for url in urls]
+
+def lxc_snapshot(container_name, snapshot):
+    if use_lxd_api():
+        lxd.snapshot(container_name, snapshot)
+        return True
+    return execute_lxc_sync(f"lxc snapshot {container_name} {snapshot}")
+
+def lxc_restore(container_name, snapshot):
+    """Restore a stopped container's rootfs, config and devices from a snapshot"""
+    if use_lxd_api():
+        lxd.restore(container_name, snapshot)
+        return True
+    return execute_lxc_sync(f"lxc restore {container_name} {snapshot}")
+
+def provision_container(container_name, os_key, ram_mb, cpu, disk_gb, progress=None, start=True):
+    """Create a container for an OS_OPTIONS key, apply limits and start it.
+
+    Uses a ready container from the warm pool when there is one, else a
+    clone of the OS's golden container, else the image. Returns which one:
+    'warm_pool', 'golden' or 'image'. With start=False the container is
+    left stopped.
+    """
+    progress = progress or (lambda step: None)
+    pristine = pristine_snapshots_enabled()
+    progress('init')
+    if claim_warm_container(os_key, container_name):
+        source = 'warm_pool'
+        progress('config')
+        # Re-render the image templates (hostname, hosts) for the new name on first start
+        lxc_set_limits(container_name, ram_mb, cpu, disk_gb, config={'volatile.apply_template': 'create'})
+    else:
+        # Limits (and start, unless a snapshot is taken first) are part of the create request
+        source = create_container(container_name, os_key, ram_mb, cpu, disk_gb,
+                                  start=start and not pristine)
+        if not pristine:
+            return source
+    if pristine:
+        progress('snapshot')
+        lxc_snapshot(container_name, pristine_snapshot_name(os_key))
+    if start:
+        progress('start')
+        lxc_set_state(container_name, 'start')
+    return source
+
+def create_container(container_name, os_key, ram_mb=None, cpu=None, disk_gb=None, start=False,
+                     timeout=120):
+    """Clone the OS's golden container, or create from the image without one.
+
+    Returns 'golden' or 'image'.
+    """
+    golden = golden_container(os_key)
+    if golden:
+        try:
+            lxc_clone(golden, container_name, ram_mb, cpu, disk_gb, start=start)
+            return 'golden'
+        except Exception as e:
+            # Being rebuilt right now, or gone: fall back to the image
+            app.logger.warning("Could not clone %s, creating %s from the image: %s", golden, container_name, e)
+            discard_container(container_name)
+    image = os_image(os_key)
+    remote_image = OS_OPTIONS.get(os_key, 'ubuntu:22.04')
+    try:
+        lxc_create(container_name, image, ram_mb, cpu, disk_gb, start=start, timeout=timeout)
+    except Exception as e:
+        if image == remote_image:
+            raise
+        # The cached copy went missing: fall back to the remote image
+        app.logger.warning("Could not create %s from %s, using %s: %s", container_name, image, remote_image, e)
+        discard_container(container_name)
+        lxc_create(container_name, remote_image, ram_mb, cpu, disk_gb, start=start, timeout=timeout)
+    return 'image'
+
+def restore_container(container_name, os_key, ram_mb, cpu, disk_gb, progress=None, start=True):
+    """Reinstall a container from its pristine snapshot of os_key.
+
+    Returns False without touching the container when there is no such
+    snapshot, so the caller can fall back to re-creating it. With
+    start=False the restored container is left stopped.
+    """
+    progress = progress or (lambda step: None)
+    snapshot = pristine_snapshot_name(os_key)
+    if not pristine_snapshots_enabled() or snapshot not in lxc_snapshots(container_name):
+        return False
+    progress('restore')
+    if get_container_status(container_name).lower() == 'running':
+        lxc_set_state(container_name, 'stop', force=True)
+    lxc_restore(container_name, snapshot)
+    # The snapshot carries the limits from provisioning time, resizes since then are re-applied
+    progress('config')
+    lxc_set_limits(container_name, ram_mb, cpu, disk_gb)
+    if start:
+        progress('start')
+        lxc_set_state(container_name, 'start')
+    return True
+
+def lxc_exec(container_name, command, timeout=60, check=False):
+    """Run a command inside a container, returns (exit code, stdout, stderr)"""
+    if use_lxd_api():
+        code, stdout, stderr = lxd.exec(container_name, command, timeout=timeout)
+    else:
+        result = subprocess.run(
+            ["lxc", "exec", container_name, "--"] + list(command),
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+        code, stdout, stderr = result.returncode, result.stdout, result.stderr
+    if check and code != 0:
+        raise Exception(stderr or "Command failed")
+    return code, stdout, stderr
+
 # Container Stats Functions
 def get_container_status(container_name):
     try:
+        if use_lxd_api():
+            return lxd.status(container_name)
         output = execute_lxc_sync(f"lxc info {container_name}")
         for line in output.splitlines():
             if line.startswith("Status: "):
@@ -243,16 +1461,278 @@ def get_container_status(container_name):
     except:
         return "Unknown"
 
+def _instance_state(instance):
+    """Flatten an LXD instance (with state) into the fields the panel shows"""
+    state = instance.get('state') or {}
+    network = state.get('network') or {}
+    counters = [iface.get('counters') or {} for name, iface in network.items() if name != 'lo']
+    root_disk = (state.get('disk') or {}).get('root') or {}
+    return {
+        'status': instance.get('status') or state.get('status') or 'Unknown',
+        'memory_bytes': (state.get('memory') or {}).get('usage', 0),
+        'cpu_ns': (state.get('cpu') or {}).get('usage', 0),
+        'disk_bytes': root_disk.get('usage'),
+        'disk_total': root_disk.get('total') or None,
+        'rx_bytes': sum(c.get('bytes_received', 0) for c in counters),
+        'tx_bytes': sum(c.get('bytes_sent', 0) for c in counters)
+    }
+
+def get_fleet_state():
+    """Get status and usage counters of every container in one call"""
+    try:
+        if use_lxd_api():
+            instances = lxd.list_instances()
+        else:
+            instances = json.loads(execute_lxc_sync("lxc list --format json"))
+        return {instance['name']: _instance_state(instance) for instance in instances}
+    except Exception as e:
+        app.logger.warning("Could not fetch container states: %s", e)
+        return {}
+
+# Host-side cgroup stats
+# CPU, memory and IO usage are read from the container's cgroup v2 files on
+# the host instead of running top/free inside the guest. CPU% comes from the
+# usage_usec delta between two samples, relative to the cores the container
+# may use, so a container's first sample has no CPU% yet. Running processes
+# in the guest is only a fallback of single on-demand requests on hosts
+# without cgroup v2; the periodic sweep records None instead.
+_cpu_samples = {}
+_cpu_samples_lock = threading.Lock()
+
+def _cgroup_dir(container_name):
+    path = os.path.join(CGROUP_ROOT, CGROUP_PATH_TEMPLATE.format(name=container_name))
+    return path if os.path.isfile(os.path.join(path, 'cpu.stat')) else None
+
+def _read_cgroup_file(path, name):
+    with open(os.path.join(path, name)) as f:
+        return f.read()
+
+def _read_keyed(text):
+    values = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            values[parts[0]] = int(parts[1])
+    return values
+
+def _count_cpus(cpuset):
+    count = 0
+    for part in cpuset.strip().split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            count += int(end) - int(start) + 1
+        elif part:
+            count += 1
+    return count
+
+def _cgroup_cpu_limit(path):
+    """Number of cores the cgroup may use (cpu.max quota or cpuset)"""
+    try:
+        quota, period = _read_cgroup_file(path, 'cpu.max').split()
+        if quota != 'max':
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        cpus = _count_cpus(_read_cgroup_file(path, 'cpuset.cpus.effective'))
+        if cpus:
+            return cpus
+    except (OSError, ValueError):
+        pass
+    return os.cpu_count() or 1
+
+def _host_memory_bytes():
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def read_cgroup_stats(container_name):
+    """Read raw cgroup v2 counters of a container, None if not available"""
+    path = _cgroup_dir(container_name)
+    if path is None:
+        return None
+    try:
+        cpu_stat = _read_keyed(_read_cgroup_file(path, 'cpu.stat'))
+        memory_current = int(_read_cgroup_file(path, 'memory.current'))
+        memory_max = _read_cgroup_file(path, 'memory.max').strip()
+        try:
+            inactive_file = _read_keyed(_read_cgroup_file(path, 'memory.stat')).get('inactive_file', 0)
+        except OSError:
+            inactive_file = 0
+        io_read = io_write = 0
+        try:
+            for line in _read_cgroup_file(path, 'io.stat').splitlines():
+                for field in line.split()[1:]:
+                    key, _, value = field.partition('=')
+                    if key == 'rbytes':
+                        io_read += int(value)
+                    elif key == 'wbytes':
+                        io_write += int(value)
+        except OSError:
+            pass
+    except (OSError, ValueError):
+        return None
+    return {
+        'time': time.monotonic(),
+        'cpu_usec': cpu_stat.get('usage_usec', 0),
+        'cpu_limit': _cgroup_cpu_limit(path),
+        'memory_bytes': max(memory_current - inactive_file, 0),
+        'memory_max': None if memory_max == 'max' else int(memory_max),
+        'io_read_bytes': io_read,
+        'io_write_bytes': io_write
+    }
+
+def cgroup_cpu_percent(container_name, sample):
+    """CPU% since the previous sample of this container, None for the first one"""
+    with _cpu_samples_lock:
+        previous = _cpu_samples.get(container_name)
+        _cpu_samples[container_name] = (sample['time'], sample['cpu_usec'])
+    if previous is None:
+        return None
+    elapsed = (sample['time'] - previous[0]) * 1000000
+    if elapsed <= 0:
+        return None
+    usage = (sample['cpu_usec'] - previous[1]) / elapsed / sample['cpu_limit'] * 100
+    return min(max(usage, 0.0), 100.0)
+
+def _exec_cpu_percent(container_name):
+    try:
+        _, output, _ = lxc_exec(container_name, ["top", "-bn1"], timeout=10)
+        for line in output.splitlines():
+            if '%Cpu(s):' in line:
+                words = line.split()
+                for i, word in enumerate(words):
+                    if word == 'id,':
+                        idle_str = words[i-1].rstrip(',')
+                        try:
+                            idle = float(idle_str)
+                            return 100.0 - idle
+                        except ValueError:
+                            pass
+                break
+    except:
+        pass
+    return None
+
+def _exec_memory_mb(container_name):
+    try:
+        _, output, _ = lxc_exec(container_name, ["free", "-m"], timeout=10)
+        lines = output.splitlines()
+        if len(lines) > 1:
+            parts = lines[1].split()
+            return int(parts[2]), int(parts[1])
+    except:
+        pass
+    return None
+
+def _exec_disk_bytes(container_name):
+    try:
+        _, output, _ = lxc_exec(container_name, ["df", "-B1", "/"], timeout=10)
+        for line in output.splitlines():
+            if '/dev/' in line and ' /' in line:
+                parts = line.split()
+                if len(parts) >= 5:
+                    return int(parts[2]), int(parts[1])
+    except:
+        pass
+    return None
+
+def cgroup_memory_mb(sample):
+    """(used, total) memory in MB of a cgroup sample"""
+    used = sample['memory_bytes'] // (1024 * 1024)
+    total = (sample['memory_max'] or _host_memory_bytes()) // (1024 * 1024)
+    return used, total
+
+def fleet_disk_bytes(state):
+    """(used, total) root disk bytes from a get_fleet_state() entry, None if unknown"""
+    if state.get('disk_bytes') is None:
+        return None
+    return state['disk_bytes'], state.get('disk_total')
+
+def container_cpu_percent(container_name):
+    """CPU usage in percent of the container's cores, None if unavailable"""
+    sample = read_cgroup_stats(container_name)
+    if sample is not None:
+        return cgroup_cpu_percent(container_name, sample)
+    return _exec_cpu_percent(container_name)
+
+def container_memory_mb(container_name):
+    """(used, total) memory in MB, None if unavailable"""
+    sample = read_cgroup_stats(container_name)
+    if sample is not None:
+        return cgroup_memory_mb(sample)
+    return _exec_memory_mb(container_name)
+
+def container_disk_bytes(container_name, fallback=True):
+    """(used, total) root disk bytes, total may be None; None if unavailable"""
+    try:
+        if use_lxd_api():
+            # Root disk usage as reported by the storage driver
+            root = (lxd.state(container_name).get('disk') or {}).get('root') or {}
+            if root.get('usage') is not None:
+                return root['usage'], root.get('total') or None
+    except Exception:
+        pass
+    return _exec_disk_bytes(container_name) if fallback else None
+
+def container_io_bytes(container_name):
+    """(read, written) bytes since the container started, None if unavailable"""
+    sample = read_cgroup_stats(container_name)
+    if sample is None:
+        return None
+    return sample['io_read_bytes'], sample['io_write_bytes']
+
+def format_cpu(usage):
+    return f"{usage or 0.0:.1f}%"
+
+def format_memory(memory):
+    if memory is None:
+        return "Unknown"
+    used, total = memory
+    usage_pct = (used / total * 100) if total > 0 else 0
+    return f"{used}/{total} MB ({usage_pct:.1f}%)"
+
+def format_disk(disk):
+    if disk is None:
+        return "Unknown"
+    used, total = disk[0] / (1024 ** 3), disk[1]
+    if not total:
+        return f"{used:.1f}G"
+    size = total / (1024 ** 3)
+    return f"{used:.1f}G/{size:.1f}G ({used / size * 100:.0f}%)"
+
+def format_io(io):
+    if io is None:
+        return "Unknown"
+    return f"{io[0] / (1024 * 1024):.1f} MB read / {io[1] / (1024 * 1024):.1f} MB written"
+
 def get_container_cpu(container_name):
+    return format_cpu(container_cpu_percent(container_name))
+
+def get_container_memory(container_name):
+    return format_memory(container_memory_mb(container_name))
+
+def get_container_disk(container_name):
+    return format_disk(container_disk_bytes(container_name))
+
+def get_container_io(container_name):
+    return format_io(container_io_bytes(container_name))
+
+def get_uptime():
     try:
-        result = subprocess.run(
-            ["lxc", "exec", container_name, "--", "top", "-bn1"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        result = subprocess.run(['uptime'], capture_output=True, text=True)
+        return result.stdout.strip()
+    except:
+        return "Unknown"
+
+def get_cpu_usage():
+    """Get current CPU usage percentage"""
+    try:
+        result = subprocess.run(['top', '-bn1'], capture_output=True, text=True)
         output = result.stdout
-        for line in output.splitlines():
+        for line in output.split('\n'):
             if '%Cpu(s):' in line:
                 words = line.split()
                 for i, word in enumerate(words):
@@ -261,105 +1741,1271 @@ def get_container_cpu(container_name):
                         try:
                             idle = float(idle_str)
                             usage = 100.0 - idle
-                            return f"{usage:.1f}%"
+                            return usage
                         except ValueError:
                             pass
                 break
-        return "0.0%"
-    except:
-        return "0.0%"
+        return 0.0
+    except Exception:
+        return 0.0
+
+# CPU Monitor Thread
+def cpu_monitor():
+    """Monitor CPU usage and stop all VPS if threshold is exceeded"""
+    global cpu_monitor_active
+    while cpu_monitor_active:
+        try:
+            cpu_usage = get_cpu_usage()
+            if cpu_usage > CPU_THRESHOLD:
+                subprocess.run(['lxc', 'stop', '--all', '--force'], check=True)
+                with data_transaction(VPS_FILE):
+                    vps_data = load_vps_data()
+                    for _, vps in _vps_index()['by_name'].values():
+                        if vps.get('status') == 'running':
+                            vps['status'] = 'stopped'
+                    save_vps_data(vps_data)
+            time.sleep(60)
+        except Exception:
+            time.sleep(60)
+
+# Stats Sampler
+# A background thread samples every container each STATS_INTERVAL seconds
+# into _stats_cache. Request handlers read the latest sample and its age
+# instead of collecting stats themselves; a container without a sample yet
+# (first request after boot, or just started/stopped) is sampled on demand.
+# Samples of running containers are also kept in stats_history (ring buffers
+# with 1m/1h rollups, saved to STATS_HISTORY_FILE) for the history charts.
+#
+# With several worker processes only the one holding STATS_SAMPLER_LOCK_FILE
+# sweeps the fleet and writes STATS_HISTORY_FILE. The others sample a
+# container on demand when their copy is older than two intervals, and
+# reload the history file when the sampler has saved a newer one, so their
+# charts lag by up to HISTORY_SAVE_INTERVAL. If the sampler exits, another
+# process takes the lock on its next round.
+#
+# Every new sample is pushed to the queues subscribed to that container (the
+# SSE stats stream). Containers with subscribers are sampled every
+# STATS_STREAM_INTERVAL, once per container however many clients watch it.
+# Subscribers are per process: each process samples what its own clients
+# watch, so a stats stream works on any worker without sticky routing.
+STATS_SAMPLER_LOCK_FILE = 'data/stats_history.sample.lock'
+_stats_cache = {}
+_stats_cache_lock = threading.Lock()
+_stats_subscribers = {}
+_stats_wakeup = threading.Event()
+_stats_sampler_lock = None
+
+HISTORY_METRICS = ('cpu', 'memory_mb', 'disk_gb')
+stats_history = StatsHistory(HISTORY_METRICS, STATS_HISTORY_FILE)
+stats_history.load()
+_stats_history_signature = _file_signature(STATS_HISTORY_FILE)
+
+def refresh_stats_history():
+    """Reload the history saved by the sampling process, if it changed"""
+    global _stats_history_signature
+    if _stats_sampler_lock is not None:
+        return
+    signature = _file_signature(STATS_HISTORY_FILE)
+    if signature != _stats_history_signature:
+        _stats_history_signature = signature
+        stats_history.load()
+
+def save_stats_history():
+    if _stats_sampler_lock is None:
+        # Only the sampling process writes the file
+        return
+    try:
+        stats_history.save()
+    except Exception as e:
+        app.logger.warning("Could not save stats history: %s", e)
+
+atexit.register(save_stats_history)
+
+def sample_container_stats(container_name, state=None, record=False, fallback=False):
+    """Collect stats of one container and store them as its latest sample.
+
+    The periodic sweep passes the container's get_fleet_state() entry, so
+    status and disk usage come from that one fleet-wide request. Commands
+    are only run inside the guest with fallback, for a single on-demand
+    sample of a host without cgroup v2 counters."""
+    status = state['status'] if state else get_container_status(container_name)
+    if status.lower() == 'running':
+        # Read the cgroup files once for CPU, memory and IO
+        sample = read_cgroup_stats(container_name)
+        if sample is not None:
+            cpu = cgroup_cpu_percent(container_name, sample)
+            memory = cgroup_memory_mb(sample)
+            io = sample['io_read_bytes'], sample['io_write_bytes']
+        elif fallback:
+            cpu = _exec_cpu_percent(container_name)
+            memory = _exec_memory_mb(container_name)
+            io = None
+        else:
+            cpu = memory = io = None
+        if state:
+            disk = fleet_disk_bytes(state)
+        else:
+            disk = container_disk_bytes(container_name, fallback=fallback)
+        stats = {
+            'status': status,
+            'cpu': format_cpu(cpu),
+            'memory': format_memory(memory),
+            'disk': format_disk(disk),
+            'io': format_io(io)
+        }
+        if record:
+            stats_history.record(container_name, time.time(), [
+                cpu,
+                memory[0] if memory else None,
+                disk[0] / (1024 ** 3) if disk else None
+            ])
+    else:
+        stats = {'status': status, 'cpu': '0.0%', 'memory': 'Unknown', 'disk': 'Unknown', 'io': 'Unknown'}
+    entry = {'stats': stats, 'sampled_at': time.monotonic()}
+    with _stats_cache_lock:
+        _stats_cache[container_name] = entry
+        subscribers = list(_stats_subscribers.get(container_name, ()))
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait((container_name, entry))
+        except queue.Full:
+            # Slow client, it will get the next sample
+            pass
+    return entry
+
+def get_container_stats(container_name):
+    """Latest stats sample of a container and its age in seconds"""
+    with _stats_cache_lock:
+        entry = _stats_cache.get(container_name)
+    if entry is None or time.monotonic() - entry['sampled_at'] > 2 * STATS_INTERVAL:
+        entry = sample_container_stats(container_name, fallback=True)
+    return entry['stats'], round(time.monotonic() - entry['sampled_at'], 1)
+
+def invalidate_container_stats(container_name):
+    with _stats_cache_lock:
+        _stats_cache.pop(container_name, None)
+    _stats_wakeup.set()
+
+def subscribe_stats(container_names):
+    """Return a queue receiving (container name, sample) for every new sample"""
+    subscriber = queue.Queue(maxsize=20)
+    with _stats_cache_lock:
+        for name in container_names:
+            _stats_subscribers.setdefault(name, set()).add(subscriber)
+    _stats_wakeup.set()
+    return subscriber
+
+def unsubscribe_stats(subscriber, container_names):
+    with _stats_cache_lock:
+        for name in container_names:
+            subscribers = _stats_subscribers.get(name)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del _stats_subscribers[name]
+
+def stats_sampler():
+    """Refresh the stats of every container on STATS_INTERVAL and of watched
+    containers on STATS_STREAM_INTERVAL"""
+    global _stats_sampler_lock
+    last_save = time.monotonic()
+    last_sweep = None
+    while True:
+        if _stats_sampler_lock is None:
+            lock = _acquire_leader_lock(STATS_SAMPLER_LOCK_FILE)
+            if lock is not None:
+                # Continue the history where the previous sampler left it
+                refresh_stats_history()
+                _stats_sampler_lock = lock
+        try:
+            if _stats_sampler_lock is not None and \
+                    (last_sweep is None or time.monotonic() - last_sweep >= STATS_INTERVAL):
+                last_sweep = time.monotonic()
+                fleet = get_fleet_state()
+                names = list(_vps_index()['by_name'])
+                for name in names:
+                    sample_container_stats(name, fleet.get(name), record=True)
+                with _stats_cache_lock:
+                    for name in set(_stats_cache) - set(names):
+                        del _stats_cache[name]
+                for name in set(stats_history.names()) - set(names):
+                    stats_history.discard(name)
+                if time.monotonic() - last_save >= HISTORY_SAVE_INTERVAL:
+                    save_stats_history()
+                    last_save = time.monotonic()
+            else:
+                with _stats_cache_lock:
+                    watched = list(_stats_subscribers)
+                for name in watched:
+                    sample_container_stats(name)
+        except Exception as e:
+            app.logger.warning("Stats sampler failed: %s", e)
+        with _stats_cache_lock:
+            watching = bool(_stats_subscribers)
+        _stats_wakeup.wait(STATS_STREAM_INTERVAL if watching else STATS_INTERVAL)
+        _stats_wakeup.clear()
+
+# Streaming Commands
+# Admin commands run as `lxc exec` child processes in their own session. The
+# combined output is appended to a log file in COMMANDS_DIR and the command's
+# state (process group, owning worker, exit code...) is kept in COMMANDS_FILE,
+# so the stream and cancel requests work on any worker process of this host,
+# not only the one that started the command. Stream readers poll the log from
+# a byte offset that is also the SSE event id, so a reconnecting client
+# resumes where it left off. Past COMMAND_OUTPUT_LIMIT bytes the oldest half
+# of the output is dropped; the log's first line holds the offset of its
+# first kept byte. Finished commands are forgotten after a few minutes.
+COMMAND_RETENTION = 300
+COMMAND_POLL_INTERVAL = 0.25
+COMMAND_KEEPALIVE = 15
+_COMMAND_LOG_HEADER = 21  # "%020d\n"
+
+def load_commands():
+    try:
+        return _load_json_cached(COMMANDS_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_commands(commands):
+    return _save_json_cached(COMMANDS_FILE, commands)
+
+def _command_log_path(command_id):
+    return os.path.join(COMMANDS_DIR, f"{command_id}.log")
+
+def get_command(command_id):
+    command = load_commands().get(command_id)
+    return dict(command) if command else None
+
+def update_command(command_id, **fields):
+    with data_transaction(COMMANDS_FILE):
+        commands = load_commands()
+        command = commands.get(command_id)
+        if command is None:
+            return None
+        command.update(fields)
+        save_commands(commands)
+        return dict(command)
+
+def start_command(container_name, command):
+    """Start a shell command in a container and collect its output in the background"""
+    now = time.time()
+    process = subprocess.Popen(
+        ['lxc', 'exec', container_name, '--', 'bash', '-c', command],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        start_new_session=True
+    )
+    job = {
+        'id': secrets.token_hex(8),
+        'vps': container_name,
+        'command': command,
+        'pid': process.pid,
+        'worker': _worker_id(),
+        'exit_code': None,
+        'cancelled': False,
+        'timed_out': False,
+        'started': now,
+        'finished': None
+    }
+    _atomic_write(_command_log_path(job['id']), f"{0:020d}\n")
+    with data_transaction(COMMANDS_FILE):
+        commands = load_commands()
+        for command_id, old in list(commands.items()):
+            if old['finished'] and now - old['finished'] > COMMAND_RETENTION:
+                del commands[command_id]
+                try:
+                    os.remove(_command_log_path(command_id))
+                except FileNotFoundError:
+                    pass
+        commands[job['id']] = job
+        save_commands(commands)
+    threading.Thread(target=_collect_command_output, args=(job['id'], process), daemon=True).start()
+    return job
+
+def _trim_command_log(path):
+    """Drop the oldest output of a command log, keeping the newest half of the limit"""
+    with open(path, 'rb') as f:
+        base = int(f.readline())
+        data = f.read()
+    cut = len(data) - COMMAND_OUTPUT_LIMIT // 2
+    while cut < len(data) and data[cut] & 0xC0 == 0x80:
+        # Don't start in the middle of a character
+        cut += 1
+    _atomic_write(path, f"{base + cut:020d}\n" + data[cut:].decode('utf-8'))
+
+def _collect_command_output(command_id, process):
+    path = _command_log_path(command_id)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    timer = threading.Timer(COMMAND_TIMEOUT, _timeout_command, (command_id, process.pid))
+    timer.daemon = True
+    timer.start()
+    log = open(path, 'ab')
+    try:
+        while True:
+            data = process.stdout.read1(4096)
+            text = decoder.decode(data, final=not data)
+            if text:
+                log.write(text.encode('utf-8'))
+                log.flush()
+                if log.tell() - _COMMAND_LOG_HEADER > COMMAND_OUTPUT_LIMIT:
+                    log.close()
+                    _trim_command_log(path)
+                    log = open(path, 'ab')
+            if not data:
+                break
+        process.wait()
+    finally:
+        timer.cancel()
+        process.stdout.close()
+        log.close()
+        update_command(command_id, exit_code=process.returncode, finished=time.time())
+
+def _timeout_command(command_id, pid):
+    update_command(command_id, timed_out=True)
+    _stop_command(command_id, pid)
+
+def _signal_command(command_id, pid, sig):
+    job = get_command(command_id)
+    if job is not None and job['finished'] is None:
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            pass
+
+def _stop_command(command_id, pid):
+    # The command runs in its own session, stop everything it started
+    _signal_command(command_id, pid, signal.SIGTERM)
+    timer = threading.Timer(5, _signal_command, (command_id, pid, signal.SIGKILL))
+    timer.daemon = True
+    timer.start()
+
+def cancel_command(command_id):
+    """Stop a running command, returns False if it is unknown or already done"""
+    job = get_command(command_id)
+    if job is None or job['finished'] or not _process_alive(job['worker']):
+        return False
+    update_command(command_id, cancelled=True)
+    _stop_command(command_id, job['pid'])
+    return True
+
+def command_output_events(job, after=0):
+    """Yield SSE events with the output of a command after byte offset `after`"""
+    path = _command_log_path(job['id'])
+    last = after
+    idle = 0
+    while True:
+        # Check before reading, so a finished command's output is complete
+        finished = job['finished'] is not None or not _process_alive(job['worker'])
+        try:
+            with open(path, 'rb') as f:
+                base = int(f.readline())
+                f.seek(_COMMAND_LOG_HEADER + max(last - base, 0))
+                data = f.read()
+        except FileNotFoundError:
+            base, data = last, b''
+        if base > last:
+            yield f"event: truncated\ndata: {json.dumps(base - last)}\n\n"
+            last = base
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError as e:
+            # The collector is mid-character, leave the rest for the next poll
+            data = data[:e.start]
+            text = data.decode('utf-8', errors='replace')
+        if text:
+            last += len(data)
+            idle = 0
+            yield f"id: {last}\nevent: output\ndata: {json.dumps(text)}\n\n"
+        if finished:
+            yield "event: done\ndata: " + json.dumps({
+                'exit_code': job['exit_code'],
+                'cancelled': job['cancelled'],
+                'timed_out': job['timed_out']
+            }) + "\n\n"
+            return
+        time.sleep(COMMAND_POLL_INTERVAL)
+        idle += COMMAND_POLL_INTERVAL
+        if idle >= COMMAND_KEEPALIVE:
+            idle = 0
+            yield ": keepalive\n\n"
+        job = get_command(job['id']) or job
+
+# Background Jobs
+# Long LXC sequences (create, reinstall, resize, delete) run as jobs on a pool
+# of JOB_WORKERS threads instead of inside the request. Jobs are kept in
+# data/jobs.json with their status and current step, so /jobs/<id> can report
+# progress and queued jobs survive a restart. A job that was running in a
+# process that died is marked failed rather than retried, since its steps
+# are not idempotent.
+_job_queue = queue.Queue()
+
+def load_jobs():
+    try:
+        return _load_json_cached(JOBS_FILE)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as e:
+        app.logger.warning("%s is unreadable, starting with no jobs: %s", JOBS_FILE, e)
+        return {}
+
+def save_jobs(jobs):
+    return _save_json_cached(JOBS_FILE, jobs)
+
+def get_job(job_id):
+    job = load_jobs().get(job_id)
+    return dict(job) if job else None
+
+def recent_jobs(limit=10):
+    jobs = sorted(load_jobs().values(), key=lambda job: job['created_at'], reverse=True)
+    return [dict(job) for job in jobs[:limit]]
+
+def update_job(job_id, **fields):
+    with data_transaction(JOBS_FILE):
+        jobs = load_jobs()
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        save_jobs(jobs)
+        return dict(job)
+
+def active_job(container_name):
+    """The queued or running job working on a container, if any"""
+    for job in load_jobs().values():
+        if job['status'] in ('queued', 'running') and job['params'].get('container_name') == container_name:
+            return dict(job)
+    return None
+
+def enqueue_job(job_type, params, description):
+    """Persist a new job and hand it to the worker pool"""
+    job = {
+        'id': secrets.token_hex(8),
+        'type': job_type,
+        'params': params,
+        'description': description,
+        'status': 'queued',
+        'steps': list(_JOB_TYPES[job_type][1]),
+        'step': None,
+        'step_index': 0,
+        'error': None,
+        'result': None,
+        'created_by': session.get('username'),
+        'created_at': datetime.now().isoformat(),
+        'started_at': None,
+        'finished_at': None,
+        'worker': None
+    }
+    with data_transaction(JOBS_FILE):
+        jobs = load_jobs()
+        finished = sorted((j for j in jobs.values() if j['status'] in ('done', 'failed')),
+                          key=lambda j: j['created_at'])
+        for old in finished[:max(len(finished) - JOB_HISTORY + 1, 0)]:
+            del jobs[old['id']]
+        jobs[job['id']] = job
+        save_jobs(jobs)
+    _job_queue.put(job['id'])
+    return job
+
+def job_progress(job_id, step):
+    job = get_job(job_id)
+    if job is not None:
+        index = job['steps'].index(step) + 1 if step in job['steps'] else job['step_index']
+        update_job(job_id, step=step, step_index=index)
+
+def _worker_id():
+    return f"{os.uname().nodename}:{os.getpid()}"
+
+def _claim_job(job_id):
+    with data_transaction(JOBS_FILE):
+        jobs = load_jobs()
+        job = jobs.get(job_id)
+        if job is None or job['status'] != 'queued':
+            return None
+        job.update(status='running', started_at=datetime.now().isoformat(), worker=_worker_id())
+        save_jobs(jobs)
+        return dict(job)
+
+def _run_job(job_id):
+    job = _claim_job(job_id)
+    if job is None:
+        return
+    function = _JOB_TYPES[job['type']][0]
+    try:
+        result = function(job_id, **job['params'])
+        update_job(job_id, status='done', step=None, step_index=len(job['steps']),
+                   result=result, finished_at=datetime.now().isoformat())
+    except Exception as e:
+        update_job(job_id, status='failed', error=str(e), finished_at=datetime.now().isoformat())
+
+def job_worker():
+    while True:
+        job_id = _job_queue.get()
+        try:
+            _run_job(job_id)
+        except Exception:
+            app.logger.exception("Job %s crashed", job_id)
+
+def _process_alive(worker):
+    host, _, pid = (worker or '').rpartition(':')
+    if host != os.uname().nodename or not pid.isdigit():
+        # Another host's worker, assume it is alive
+        return bool(host)
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _recover_jobs():
+    """Requeue queued jobs and fail the ones whose worker process is gone"""
+    with data_transaction(JOBS_FILE):
+        jobs = load_jobs()
+        changed = False
+        for job in jobs.values():
+            if job['status'] == 'queued':
+                _job_queue.put(job['id'])
+            elif job['status'] == 'running' and not _process_alive(job.get('worker')):
+                job.update(status='failed', error='Interrupted by a restart',
+                           finished_at=datetime.now().isoformat())
+                changed = True
+        if changed:
+            save_jobs(jobs)
+
+def _job_create_vps(job_id, owner, container_name, hostname, ram_mb, cpu, disk_gb, os_key,
+                    plan=None, buy_id=None):
+    source = provision_container(container_name, os_key, ram_mb, cpu, disk_gb,
+                                 progress=lambda step: job_progress(job_id, step))
+    job_progress(job_id, 'save')
+    vps_info = {
+        "container_name": container_name,
+        "hostname": hostname,
+        "ram_mb": ram_mb,
+        "cpu": cpu,
+        "disk_gb": disk_gb,
+        "status": "running",
+        "suspended": False,
+        "suspension_history": [],
+        "created_at": datetime.now().isoformat(),
+        "shared_with": [],
+        "os": os_key
+    }
+    if plan:
+        vps_info['plan'] = plan
+    add_vps(owner, vps_info)
+    if buy_id:
+        with data_transaction(PENDING_PAYMENTS_FILE):
+            pending_payments = load_pending_payments()
+            pending_payments.pop(buy_id, None)
+            save_pending_payments(pending_payments)
+    preinstall_tmate(container_name)
+    return {'container_name': container_name, 'source': source}
+
+def _job_reinstall_vps(job_id, container_name, os_key):
+    _, vps = find_vps(container_name)
+    if not vps:
+        raise Exception('VPS not found')
+    progress = lambda step: job_progress(job_id, step)
+    if restore_container(container_name, os_key, vps['ram_mb'], vps['cpu'], vps['disk_gb'],
+                         progress=progress, start=False):
+        result = {'container_name': container_name, 'source': 'snapshot'}
+    else:
+        job_progress(job_id, 'delete')
+        lxc_delete(container_name)
+        source = provision_container(container_name, os_key, vps['ram_mb'], vps['cpu'], vps['disk_gb'],
+                                     progress=progress, start=False)
+        result = {'container_name': container_name, 'source': source}
+    forget_tmate(container_name)
+    # A suspended VPS stays stopped, also if it was suspended while reinstalling
+    _, vps = find_vps(container_name)
+    suspended = bool(vps and vps.get('suspended'))
+    if not suspended:
+        job_progress(job_id, 'start')
+        lxc_set_state(container_name, 'start')
+    job_progress(job_id, 'save')
+    update_vps(container_name, status='suspended' if suspended else 'running', os=os_key)
+    if not suspended:
+        preinstall_tmate(container_name)
+    return result
+
+def _job_resize_vps(job_id, container_name, ram_mb, cpu, disk_gb):
+    _, vps = find_vps(container_name)
+    if not vps:
+        raise Exception('VPS not found')
+    # Stop VPS if running
+    was_running = vps.get('status') == 'running'
+    if was_running:
+        job_progress(job_id, 'stop')
+        lxc_set_state(container_name, 'stop')
+    job_progress(job_id, 'config')
+    lxc_set_limits(container_name, ram_mb, cpu, disk_gb)
+    # Restart if it was running
+    if was_running:
+        job_progress(job_id, 'start')
+        lxc_set_state(container_name, 'start')
+    job_progress(job_id, 'save')
+    update_vps(container_name, ram_mb=ram_mb, cpu=cpu, disk_gb=disk_gb)
+    return {'container_name': container_name}
+
+def _job_delete_vps(job_id, container_name):
+    job_progress(job_id, 'delete')
+    lxc_delete(container_name)
+    forget_tmate(container_name)
+    job_progress(job_id, 'save')
+    remove_vps(container_name)
+    return {'container_name': container_name}
+
+# job type -> (function, steps)
+_JOB_TYPES = {
+    'create_vps': (_job_create_vps, ('init', 'config', 'snapshot', 'start', 'save')),
+    'reinstall_vps': (_job_reinstall_vps, ('restore', 'delete', 'init', 'config', 'snapshot', 'start', 'save')),
+    'resize_vps': (_job_resize_vps, ('stop', 'config', 'start', 'save')),
+    'delete_vps': (_job_delete_vps, ('delete', 'save')),
+}
+
+# Warm Pool
+# A background filler keeps warm_pool_sizes[os_key] stopped containers of
+# every OS initialized ahead of time, so provisioning only renames one, applies
+# limits and starts it instead of unpacking an image. Pool containers are
+# created as warming-<os_key>-<suffix> and renamed to warm-<os_key>-<suffix>
+# once complete, so a half-created one is never handed out. LXD renames are
+# atomic, which lets every process claim from the same pool; only the process
+# holding WARM_POOL_LOCK_FILE fills it. Hit/miss counts and refill times are
+# kept in WARM_POOL_FILE.
+WARM_POOL_PREFIX = 'warm-'
+WARMING_PREFIX = 'warming-'
+WARM_POOL_LOCK_FILE = 'data/warm_pool.fill.lock'
+WARM_POOL_REFILLS_KEPT = 50
+_warm_pool_wakeup = threading.Event()
+
+def _parse_pool_sizes(value):
+    sizes = {os_key: WARM_POOL_SIZE for os_key in OS_OPTIONS}
+    for item in value.split(','):
+        os_key, _, size = item.strip().partition(':')
+        if os_key in sizes and size.strip().isdigit():
+            sizes[os_key] = int(size)
+    return sizes
+
+warm_pool_sizes = _parse_pool_sizes(WARM_POOL_SIZES)
+
+def warm_pool_enabled():
+    return any(warm_pool_sizes.values())
+
+def load_warm_pool_stats():
+    try:
+        return _load_json_cached(WARM_POOL_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'hits': 0, 'misses': 0, 'refills': [], 'last_error': None}
+
+def _update_warm_pool_stats(update):
+    with data_transaction(WARM_POOL_FILE):
+        stats = load_warm_pool_stats()
+        update(stats)
+        _save_json_cached(WARM_POOL_FILE, stats)
+
+def _warm_pool_listing():
+    """Return ({os_key: [ready container names]}, [containers still being created])"""
+    ready = {os_key: [] for os_key in OS_OPTIONS}
+    warming = []
+    for name, state in get_fleet_state().items():
+        if name.startswith(WARMING_PREFIX):
+            warming.append(name)
+        elif name.startswith(WARM_POOL_PREFIX) and state['status'] == 'Stopped':
+            os_key = name[len(WARM_POOL_PREFIX):].rpartition('-')[0]
+            if os_key in ready:
+                ready[os_key].append(name)
+    return ready, warming
+
+def claim_warm_container(os_key, container_name):
+    """Rename a ready pool container of os_key to container_name, True on a hit"""
+    if not warm_pool_sizes.get(os_key):
+        return False
+    hit = False
+    for name in _warm_pool_listing()[0].get(os_key, []):
+        try:
+            lxc_rename(name, container_name)
+        except Exception:
+            # Claimed by another process in the meantime
+            continue
+        hit = True
+        break
+
+    def count(stats):
+        stats['hits' if hit else 'misses'] += 1
+    _update_warm_pool_stats(count)
+    _warm_pool_wakeup.set()
+    return hit
+
+def _create_warm_container(os_key):
+    suffix = secrets.token_hex(3)
+    temp_name = f"{WARMING_PREFIX}{os_key}-{suffix}"
+    started = time.time()
+    try:
+        # Long timeout: the first container of an OS may download its image
+        create_container(temp_name, os_key, timeout=600)
+        lxc_rename(temp_name, f"{WARM_POOL_PREFIX}{os_key}-{suffix}")
+    except Exception as e:
+        app.logger.warning("Could not create warm %s container: %s", os_key, e)
+        discard_container(temp_name)
+
+        def failed(stats):
+            stats['last_error'] = {'os': os_key, 'message': str(e), 'at': datetime.now().isoformat()}
+        _update_warm_pool_stats(failed)
+        return False
+
+    def refilled(stats):
+        stats['refills'] = (stats['refills'] + [{
+            'os': os_key,
+            'seconds': round(time.time() - started, 1),
+            'at': datetime.now().isoformat()
+        }])[-WARM_POOL_REFILLS_KEPT:]
+    _update_warm_pool_stats(refilled)
+    return True
+
+def _fill_warm_pool():
+    ready, warming = _warm_pool_listing()
+    # Only the filler creates pool containers, so these were left by a crash
+    for name in warming:
+        try:
+            lxc_delete(name)
+        except Exception as e:
+            app.logger.warning("Could not remove stale pool container %s: %s", name, e)
+    for os_key, size in warm_pool_sizes.items():
+        for _ in range(size - len(ready.get(os_key, []))):
+            if not _create_warm_container(os_key):
+                # Try again next round rather than hammering a failing image
+                break
+
+def _acquire_leader_lock(path):
+    """Non-blocking lock electing the one process that runs a background task"""
+    if fcntl is None:
+        return True
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def warm_pool_filler():
+    lock = None
+    while True:
+        if lock is None:
+            lock = _acquire_leader_lock(WARM_POOL_LOCK_FILE)
+        if lock is not None:
+            try:
+                _fill_warm_pool()
+            except Exception as e:
+                app.logger.warning("Warm pool refill failed: %s", e)
+        _warm_pool_wakeup.wait(WARM_POOL_INTERVAL)
+        _warm_pool_wakeup.clear()
+
+def warm_pool_status():
+    """Pool fill levels, hit rate and refill latency"""
+    ready, _ = _warm_pool_listing()
+    stats = load_warm_pool_stats()
+    lookups = stats['hits'] + stats['misses']
+    seconds = [refill['seconds'] for refill in stats['refills']]
+    return {
+        'enabled': warm_pool_enabled(),
+        'pools': {os_key: {'target': size, 'ready': len(ready.get(os_key, []))}
+                  for os_key, size in warm_pool_sizes.items()},
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'hit_rate': round(stats['hits'] * 100 / lookups, 1) if lookups else None,
+        'refill_last_seconds': seconds[-1] if seconds else None,
+        'refill_avg_seconds': round(sum(seconds) / len(seconds), 1) if seconds else None,
+        'refill_max_seconds': max(seconds) if seconds else None,
+        'last_error': stats['last_error']
+    }
+
+# Golden Containers
+# For the OS keys in GOLDEN_CONTAINERS a customized, stopped base container
+# golden-<os_key> is built from the image (GOLDEN_SETUP_COMMAND: updates,
+# tmate) and rebuilt every GOLDEN_REFRESH_INTERVAL. New containers, warm pool
+# ones included, are copied from it; on zfs/btrfs pools that is a snapshot
+# clone sharing blocks with the base. A rebuild happens under a temporary
+# name and replaces the old base only once it succeeded. Build times and
+# errors are kept in GOLDEN_FILE; only the process holding GOLDEN_LOCK_FILE
+# builds.
+GOLDEN_PREFIX = 'golden-'
+GOLDEN_LOCK_FILE = 'data/golden.build.lock'
+GOLDEN_CHECK_INTERVAL = 600
+# Run in the base container before it is stopped, so clones boot as new machines
+GOLDEN_CLEANUP_COMMAND = "cloud-init clean --logs >/dev/null 2>&1; truncate -s 0 /etc/machine-id"
+
+def _parse_golden_os(value):
+    if value.strip().lower() == 'all':
+        return list(OS_OPTIONS)
+    return [os_key for os_key in (item.strip() for item in value.split(',')) if os_key in OS_OPTIONS]
+
+golden_os_keys = _parse_golden_os(GOLDEN_CONTAINERS)
+
+def golden_name(os_key):
+    return f"{GOLDEN_PREFIX}{os_key}"
+
+def load_golden_state():
+    try:
+        return _load_json_cached(GOLDEN_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _update_golden_state(os_key, **fields):
+    with data_transaction(GOLDEN_FILE):
+        state = load_golden_state()
+        state.setdefault(os_key, {}).update(fields)
+        _save_json_cached(GOLDEN_FILE, state)
+
+def golden_container(os_key):
+    """Name of the OS's golden container, None if it has none (yet)"""
+    if os_key in golden_os_keys and (load_golden_state().get(os_key) or {}).get('built_at'):
+        return golden_name(os_key)
+    return None
+
+def build_golden_container(os_key):
+    """(Re)build the golden container of an OS, returns True on success"""
+    name = golden_name(os_key)
+    temp_name = f"{name}-new"
+    started = time.time()
+    try:
+        discard_container(temp_name)
+        lxc_create(temp_name, os_image(os_key), start=True, timeout=600)
+        lxc_exec(temp_name, ['bash', '-c', GOLDEN_SETUP_COMMAND], timeout=GOLDEN_SETUP_TIMEOUT, check=True)
+        lxc_exec(temp_name, ['bash', '-c', GOLDEN_CLEANUP_COMMAND], check=True)
+        lxc_set_state(temp_name, 'stop')
+        discard_container(name)
+        lxc_rename(temp_name, name)
+    except Exception as e:
+        app.logger.warning("Could not build golden container for %s: %s", os_key, e)
+        discard_container(temp_name)
+        _update_golden_state(os_key, error=str(e), failed_at=datetime.now().isoformat())
+        return False
+    _update_golden_state(os_key, built_at=datetime.now().isoformat(), error=None,
+                         build_seconds=round(time.time() - started, 1))
+    return True
+
+def golden_refresher():
+    lock = None
+    while True:
+        if lock is None:
+            lock = _acquire_leader_lock(GOLDEN_LOCK_FILE)
+        if lock is not None:
+            state = load_golden_state()
+            for os_key in golden_os_keys:
+                built_at = (state.get(os_key) or {}).get('built_at')
+                if not built_at or \
+                        (datetime.now() - datetime.fromisoformat(built_at)).total_seconds() > GOLDEN_REFRESH_INTERVAL:
+                    build_golden_container(os_key)
+        time.sleep(GOLDEN_CHECK_INTERVAL)
+
+# Image Cache
+# Every OS_OPTIONS image is copied into the local image store under the alias
+# cached-<os_key> at startup and refreshed from its remote every
+# IMAGE_REFRESH_INTERVAL, so creating a container never waits on a download.
+# Containers are created from the local alias once it is cached and from the
+# remote image until then. The cache state (fingerprint, size, last refresh,
+# errors) is kept in IMAGES_FILE for the settings page; only the process
+# holding IMAGE_CACHE_LOCK_FILE downloads.
+IMAGE_ALIAS_PREFIX = 'cached-'
+IMAGE_CACHE_LOCK_FILE = 'data/images.fetch.lock'
+IMAGE_CHECK_INTERVAL = 600
+IMAGE_DOWNLOAD_TIMEOUT = 1800
+
+def cached_image_alias(os_key):
+    return f"{IMAGE_ALIAS_PREFIX}{os_key}"
+
+def load_image_state():
+    try:
+        return _load_json_cached(IMAGES_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _update_image_state(os_key, **fields):
+    with data_transaction(IMAGES_FILE):
+        state = load_image_state()
+        state.setdefault(os_key, {}).update(fields)
+        _save_json_cached(IMAGES_FILE, state)
+
+def os_image(os_key):
+    """Image to create an OS from: the local cached copy when there is one"""
+    if IMAGE_CACHE_ENABLED and (load_image_state().get(os_key) or {}).get('fingerprint'):
+        return cached_image_alias(os_key)
+    return OS_OPTIONS.get(os_key, 'ubuntu:22.04')
 
-def get_container_memory(container_name):
+def lxc_image_info(alias):
+    """Local image behind an alias, None if there is no such alias"""
     try:
-        result = subprocess.run(
-            ["lxc", "exec", container_name, "--", "free", "-m"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        lines = result.stdout.splitlines()
-        if len(lines) > 1:
-            parts = lines[1].split()
-            total = int(parts[1])
-            used = int(parts[2])
-            usage_pct = (used / total * 100) if total > 0 else 0
-            return f"{used}/{total} MB ({usage_pct:.1f}%)"
-        return "Unknown"
-    except:
-        return "Unknown"
+        if use_lxd_api():
+            return lxd.image(lxd.image_alias(alias))
+        target = json.loads(execute_lxc_sync(f"lxc query /1.0/images/aliases/{alias}"))['target']
+        return json.loads(execute_lxc_sync(f"lxc query /1.0/images/{target}"))
+    except LXDError as e:
+        if e.status_code == 404:
+            return None
+        raise
+    except Exception as e:
+        if 'not found' in str(e).lower():
+            return None
+        raise
 
-def get_container_disk(container_name):
+def lxc_image_copy(remote_image, alias):
+    source = _image_source(remote_image)
+    if use_lxd_api() and source is not None:
+        lxd.copy_image(source, alias, timeout=IMAGE_DOWNLOAD_TIMEOUT)
+        return True
+    return execute_lxc_sync(f"lxc image copy {remote_image} local: --alias {alias} --auto-update",
+                            timeout=IMAGE_DOWNLOAD_TIMEOUT)
+
+def lxc_image_refresh(alias, fingerprint):
+    if use_lxd_api():
+        lxd.refresh_image(fingerprint, timeout=IMAGE_DOWNLOAD_TIMEOUT)
+        return True
+    return execute_lxc_sync(f"lxc image refresh {alias}", timeout=IMAGE_DOWNLOAD_TIMEOUT)
+
+def cache_image(os_key, refresh=False):
+    """Download an OS image into the local store, or refresh the local copy"""
+    alias = cached_image_alias(os_key)
+    started = time.time()
+    failed = {}
     try:
-        result = subprocess.run(
-            ["lxc", "exec", container_name, "--", "df", "-h", "/"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        lines = result.stdout.splitlines()
-        for line in lines:
-            if '/dev/' in line and ' /' in line:
-                parts = line.split()
-                if len(parts) >= 5:
-                    used = parts[2]
-                    size = parts[1]
-                    perc = parts[4]
-                    return f"{used}/{size} ({perc})"
-        return "Unknown"
-    except:
-        return "Unknown"
+        info = lxc_image_info(alias)
+        if info is None:
+            # Gone from the store: stop creating containers from it
+            failed['fingerprint'] = None
+            lxc_image_copy(OS_OPTIONS[os_key], alias)
+        elif refresh:
+            lxc_image_refresh(alias, info['fingerprint'])
+        info = lxc_image_info(alias)
+        if info is None:
+            raise Exception(f"Image alias {alias} missing after download")
+    except Exception as e:
+        app.logger.warning("Could not cache image %s: %s", OS_OPTIONS[os_key], e)
+        _update_image_state(os_key, error=str(e), failed_at=datetime.now().isoformat(), **failed)
+        return False
+    fields = {
+        'fingerprint': info['fingerprint'],
+        'size': info.get('size'),
+        'uploaded_at': info.get('uploaded_at'),
+        'checked_at': datetime.now().isoformat(),
+        'error': None
+    }
+    if refresh or not (load_image_state().get(os_key) or {}).get('refreshed_at'):
+        fields.update(refreshed_at=fields['checked_at'], fetch_seconds=round(time.time() - started, 1))
+    _update_image_state(os_key, **fields)
+    return True
 
-def get_uptime():
+def image_cache_manager():
+    lock = None
+    while True:
+        if lock is None:
+            lock = _acquire_leader_lock(IMAGE_CACHE_LOCK_FILE)
+        if lock is not None:
+            state = load_image_state()
+            for os_key in OS_OPTIONS:
+                refreshed_at = (state.get(os_key) or {}).get('refreshed_at')
+                # Every round re-downloads missing images; refresh only once they are due
+                cache_image(os_key, refresh=bool(refreshed_at) and (
+                    datetime.now() - datetime.fromisoformat(refreshed_at)).total_seconds() > IMAGE_REFRESH_INTERVAL)
+        time.sleep(IMAGE_CHECK_INTERVAL)
+
+def _format_age(seconds):
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)}h"
+    return f"{int(seconds // 86400)}d"
+
+def image_cache_status():
+    """Per OS: remote image, local alias, whether it is cached, size and age"""
+    state = load_image_state()
+    golden = load_golden_state()
+    now = datetime.now()
+    rows = []
+    for os_key, remote_image in OS_OPTIONS.items():
+        info = state.get(os_key) or {}
+        refreshed_at = info.get('refreshed_at')
+        golden_built = (golden.get(os_key) or {}).get('built_at') if os_key in golden_os_keys else None
+        rows.append({
+            'os': os_key,
+            'image': remote_image,
+            'alias': cached_image_alias(os_key),
+            'present': bool(info.get('fingerprint')),
+            'fingerprint': (info.get('fingerprint') or '')[:12],
+            'size': info.get('size'),
+            'uploaded_at': info.get('uploaded_at'),
+            'refreshed_at': refreshed_at,
+            'age': _format_age((now - datetime.fromisoformat(refreshed_at)).total_seconds())
+                   if refreshed_at else None,
+            'fetch_seconds': info.get('fetch_seconds'),
+            'error': info.get('error'),
+            'golden_age': _format_age((now - datetime.fromisoformat(golden_built)).total_seconds())
+                          if golden_built else None
+        })
+    return rows
+
+# SSH Sessions
+# Web SSH is a tmate session inside the container. One `lxc exec` runs a
+# script that hands out the newest live session if there is one, and
+# otherwise starts a new session and polls until tmate has connected
+# (bounded by SSH_READY_TIMEOUT) instead of sleeping a fixed time. tmate is
+# installed in the background after create/reinstall, or on the first SSH
+# request if it is missing. A request never waits for apt: while tmate is
+# being installed it gets SSHSessionPending and the client retries. A failed
+# install is retried no sooner than TMATE_RETRY_BACKOFF seconds later,
+# doubling per failure up to TMATE_RETRY_MAX.
+#
+# Sessions are per requester: the socket name carries a tag for the role and
+# user, so an admin never lands in the owner's terminal or the other way
+# round. Sessions handed out are recorded per container in SSH_SESSIONS_FILE
+# (socket, created_at, last_attached). A reaper kills sessions that nobody
+# was handed or typed into (tmate's session_activity) for SSH_SESSION_TTL
+# seconds. Its first sweep after startup covers every running container, so
+# sessions started before the registry existed are cleaned up too.
+TMATE_SOCKET_GLOB = '/tmp/svm-session-*.sock'
+SSH_REAPER_INTERVAL = 300
+SSH_REAPER_LOCK_FILE = 'data/ssh_sessions.reap.lock'
+TMATE_INSTALL_TIMEOUT = 300
+TMATE_POLL_INTERVAL = 0.2
+TMATE_RETRY_BACKOFF = 60
+TMATE_RETRY_MAX = 3600
+TMATE_INSTALL_SCRIPT = ("command -v tmate >/dev/null || { export DEBIAN_FRONTEND=noninteractive; "
+                        "apt-get update -y >/dev/null && apt-get install -y tmate >/dev/null; }")
+# exit code of the session script -> error
+_TMATE_ERRORS = {
+    4: 'Could not start a tmate session'
+}
+_tmate_installs = {}
+_tmate_installed = set()
+_tmate_failures = {}  # container -> (failures, retry_at, error)
+_tmate_lock = threading.Lock()
+
+class SSHSessionPending(Exception):
+    """tmate is still being installed in the container, retry shortly"""
+
+def _tmate_session_tag(role, username):
+    """Socket name tag of a requester's sessions, safe for a shell glob"""
+    return f"{role}-{hashlib.sha1(username.encode()).hexdigest()[:12]}"
+
+def _tmate_session_script(tag):
+    polls = max(int(SSH_READY_TIMEOUT / TMATE_POLL_INTERVAL), 1)
+    return f"""
+for sock in $(ls -t /tmp/svm-session-{tag}-*.sock 2>/dev/null); do
+    url=$(tmate -S "$sock" display -p '#{{tmate_ssh}}' 2>/dev/null)
+    if [ -n "$url" ]; then echo "$sock $url"; exit 0; fi
+    tmate -S "$sock" has-session 2>/dev/null || rm -f "$sock"
+done
+command -v tmate >/dev/null || exit 3
+sock=/tmp/svm-session-{tag}-$(date +%Y%m%d%H%M%S%N).sock
+tmate -S "$sock" new-session -d || exit 4
+for i in $(seq {polls}); do
+    url=$(tmate -S "$sock" display -p '#{{tmate_ssh}}' 2>/dev/null)
+    if [ -n "$url" ]; then echo "$sock $url"; exit 0; fi
+    sleep {TMATE_POLL_INTERVAL}
+done
+exit 5
+"""
+
+def _run_tmate_install(container_name, install):
     try:
-        result = subprocess.run(['uptime'], capture_output=True, text=True)
-        return result.stdout.strip()
-    except:
-        return "Unknown"
+        lxc_exec(container_name, ['bash', '-c', TMATE_INSTALL_SCRIPT], timeout=TMATE_INSTALL_TIMEOUT, check=True)
+        with _tmate_lock:
+            _tmate_installed.add(container_name)
+            _tmate_failures.pop(container_name, None)
+    except Exception as e:
+        app.logger.warning("Could not install tmate in %s: %s", container_name, e)
+        with _tmate_lock:
+            failures = _tmate_failures.get(container_name, (0, 0, None))[0] + 1
+            backoff = min(TMATE_RETRY_BACKOFF * 2 ** (failures - 1), TMATE_RETRY_MAX)
+            _tmate_failures[container_name] = (failures, time.time() + backoff, str(e))
+    finally:
+        install.set()
+        with _tmate_lock:
+            _tmate_installs.pop(container_name, None)
 
-def get_cpu_usage():
-    """Get current CPU usage percentage"""
+def preinstall_tmate(container_name):
+    """Install tmate in a container in the background, unless known to be there
+    or a recent attempt failed"""
+    with _tmate_lock:
+        if container_name in _tmate_installed or container_name in _tmate_installs:
+            return
+        failure = _tmate_failures.get(container_name)
+        if failure and time.time() < failure[1]:
+            return
+        install = _tmate_installs[container_name] = threading.Event()
+    threading.Thread(target=_run_tmate_install, args=(container_name, install), daemon=True).start()
+
+def forget_tmate(container_name):
+    """The container was re-created or deleted: no tmate, no sessions"""
+    with _tmate_lock:
+        _tmate_installed.discard(container_name)
+        _tmate_failures.pop(container_name, None)
+    with data_transaction(SSH_SESSIONS_FILE):
+        sessions = load_ssh_sessions()
+        if sessions.pop(container_name, None) is not None:
+            save_ssh_sessions(sessions)
+
+def load_ssh_sessions():
     try:
-        result = subprocess.run(['top', '-bn1'], capture_output=True, text=True)
-        output = result.stdout
-        for line in output.split('\n'):
-            if '%Cpu(s):' in line:
-                words = line.split()
-                for i, word in enumerate(words):
-                    if word == 'id,':
-                        idle_str = words[i-1].rstrip(',')
-                        try:
-                            idle = float(idle_str)
-                            usage = 100.0 - idle
-                            return usage
-                        except ValueError:
-                            pass
-                break
-        return 0.0
-    except Exception:
-        return 0.0
+        return _load_json_cached(SSH_SESSIONS_FILE)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
-# CPU Monitor Thread
-def cpu_monitor():
-    """Monitor CPU usage and stop all VPS if threshold is exceeded"""
-    global cpu_monitor_active
-    while cpu_monitor_active:
-        try:
-            cpu_usage = get_cpu_usage()
-            if cpu_usage > CPU_THRESHOLD:
-                subprocess.run(['lxc', 'stop', '--all', '--force'], check=True)
-                vps_data = load_vps_data()
-                for user_id, vps_list in vps_data.items():
-                    for vps in vps_list:
-                        if vps.get('status') == 'running':
-                            vps['status'] = 'stopped'
-                save_vps_data(vps_data)
-            time.sleep(60)
-        except Exception:
-            time.sleep(60)
+def save_ssh_sessions(sessions):
+    return _save_json_cached(SSH_SESSIONS_FILE, sessions)
+
+def _register_ssh_session(container_name, socket_path, ssh_command):
+    now = datetime.now().isoformat()
+    with data_transaction(SSH_SESSIONS_FILE):
+        sessions = load_ssh_sessions()
+        entry = sessions.setdefault(container_name, {}).setdefault(socket_path, {'created_at': now})
+        entry.update(last_attached=now, ssh_command=ssh_command)
+        save_ssh_sessions(sessions)
 
-# Start CPU monitoring
-cpu_thread = threading.Thread(target=cpu_monitor, daemon=True)
-cpu_thread.start()
+def count_ssh_sessions(container_name):
+    return len(load_ssh_sessions().get(container_name) or {})
+
+def get_ssh_session(container_name, role, username):
+    """ssh command of the requester's live tmate session in the container,
+    started if needed"""
+    with _tmate_lock:
+        installing = container_name in _tmate_installs
+    if installing:
+        raise SSHSessionPending('Preparing SSH access, please retry in a few seconds')
+    code, output, error = lxc_exec(container_name, ['bash', '-c', _tmate_session_script(_tmate_session_tag(role, username))],
+                                   timeout=SSH_READY_TIMEOUT + 10)
+    socket_path, _, ssh_command = (output.strip().splitlines() or [''])[-1].partition(' ')
+    if code == 3:
+        # No tmate yet: install it in the background instead of holding this request
+        with _tmate_lock:
+            _tmate_installed.discard(container_name)
+            failure = _tmate_failures.get(container_name)
+        if failure and time.time() < failure[1]:
+            raise Exception(f"Could not install tmate, retrying in "
+                            f"{int(failure[1] - time.time()) + 1} seconds: {failure[2]}")
+        preinstall_tmate(container_name)
+        raise SSHSessionPending('Installing SSH access, please retry in a minute')
+    if code != 0 or not ssh_command:
+        if code == 5:
+            raise Exception(f"SSH session was not ready after {SSH_READY_TIMEOUT:g} seconds")
+        raise Exception(_TMATE_ERRORS.get(code) or error.strip() or 'Failed to generate SSH link')
+    with _tmate_lock:
+        _tmate_installed.add(container_name)
+    _register_ssh_session(container_name, socket_path, ssh_command)
+    return ssh_command
+
+def _live_tmate_sessions(container_name):
+    """{socket: last activity (unix time)} of the tmate servers running in a container"""
+    script = f"""
+for sock in $(ls {TMATE_SOCKET_GLOB} 2>/dev/null); do
+    activity=$(tmate -S "$sock" display -p '#{{session_activity}}' 2>/dev/null)
+    if [ -n "$activity" ]; then echo "$sock $activity"; else rm -f "$sock"; fi
+done
+"""
+    _, output, _ = lxc_exec(container_name, ['bash', '-c', script], timeout=30, check=True)
+    live = {}
+    for line in output.splitlines():
+        socket_path, _, activity = line.strip().partition(' ')
+        live[socket_path] = int(activity) if activity.isdigit() else 0
+    return live
+
+def reap_ssh_sessions(container_name):
+    """Kill the container's tmate sessions idle longer than SSH_SESSION_TTL, returns how many"""
+    # Hand-out times as of now; the registry dict itself is updated in place by
+    # sessions handed out while the container is being checked
+    attached_before = {socket_path: entry.get('last_attached')
+                       for socket_path, entry in (load_ssh_sessions().get(container_name) or {}).items()}
+    live = _live_tmate_sessions(container_name)
+    cutoff = time.time() - SSH_SESSION_TTL
+    idle = []
+    for socket_path, activity in live.items():
+        last_attached = attached_before.get(socket_path)
+        attached = datetime.fromisoformat(last_attached).timestamp() if last_attached else 0
+        if max(activity, attached) < cutoff:
+            idle.append(socket_path)
+    if idle:
+        lxc_exec(container_name, ['bash', '-c', '; '.join(
+            f"tmate -S {shlex.quote(socket_path)} kill-server; rm -f {shlex.quote(socket_path)}"
+            for socket_path in idle)], timeout=30)
+    with data_transaction(SSH_SESSIONS_FILE):
+        sessions = load_ssh_sessions()
+        current = sessions.get(container_name) or {}
+        # Keep what is still running, and anything handed out since the check above
+        kept = {socket_path: entry for socket_path, entry in current.items()
+                if (socket_path in live and socket_path not in idle)
+                or entry.get('last_attached') != attached_before.get(socket_path)}
+        # Adopt running sessions started outside the registry (e.g. before it existed)
+        for socket_path in live:
+            if socket_path not in idle and socket_path not in kept:
+                kept[socket_path] = {'created_at': None, 'last_attached': None}
+        if kept != current:
+            if kept:
+                sessions[container_name] = kept
+            else:
+                sessions.pop(container_name, None)
+            save_ssh_sessions(sessions)
+    return len(idle)
+
+def ssh_session_reaper():
+    lock = None
+    full_sweep = True
+    while True:
+        time.sleep(SSH_REAPER_INTERVAL)
+        if lock is None:
+            lock = _acquire_leader_lock(SSH_REAPER_LOCK_FILE)
+        if lock is None:
+            continue
+        if full_sweep:
+            running = [name for name, state in get_fleet_state().items()
+                       if state['status'] == 'Running' and find_vps(name)[1]]
+        else:
+            running = list(load_ssh_sessions())
+        for container_name in running:
+            try:
+                killed = reap_ssh_sessions(container_name)
+                if killed:
+                    app.logger.info("Reaped %d idle SSH session(s) in %s", killed, container_name)
+            except Exception as e:
+                app.logger.warning("Could not reap SSH sessions in %s: %s", container_name, e)
+        full_sweep = False
+
+# Background Services
+# The monitor, sampler, job, pool, cache and reaper threads are started by
+# start_background_services(), never at import. A server that imports the
+# app and then forks workers (gunicorn --preload) would otherwise give each
+# child copies of locks and queues that parent threads might be holding, and
+# no threads at all. Every process starts its own services once: from
+# __main__, from a gunicorn post_fork hook, or on its first request.
+_services_pid = None
+_services_lock = threading.Lock()
+
+def start_background_services():
+    """Start this process's background threads, once per process"""
+    global _services_pid
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        _services_pid = os.getpid()
+    threading.Thread(target=cpu_monitor, daemon=True).start()
+    threading.Thread(target=stats_sampler, daemon=True).start()
+    _recover_jobs()
+    for _ in range(JOB_WORKERS):
+        threading.Thread(target=job_worker, daemon=True).start()
+    if warm_pool_enabled():
+        threading.Thread(target=warm_pool_filler, daemon=True).start()
+    if golden_os_keys:
+        threading.Thread(target=golden_refresher, daemon=True).start()
+    if IMAGE_CACHE_ENABLED:
+        threading.Thread(target=image_cache_manager, daemon=True).start()
+    if SSH_SESSION_TTL > 0:
+        threading.Thread(target=ssh_session_reaper, daemon=True).start()
+
+@app.before_request
+def ensure_background_services():
+    if _services_pid != os.getpid():
+        start_background_services()
 
 # Context Processor - Inject company and developer info into all templates
 @app.context_processor
@@ -374,12 +3020,37 @@ def inject_global_context():
     }
 
 # Decorators
+def _session_auth_state():
+    """Return the current account state, or a redirect if the session is no longer valid.
+
+    Revocations (ban, suspend, role change, deletion) apply on the next
+    request: a changed auth version refreshes the role kept in the session.
+    """
+    state = get_auth_state(session['username'])
+    if state is None or state['banned'] or state['suspended']:
+        if state is not None and state['banned']:
+            message = 'Your account has been banned'
+        elif state is not None:
+            message = 'Your account has been suspended'
+        else:
+            message = 'Please login to access this page'
+        session.clear()
+        flash(message, 'error')
+        return None, redirect(url_for('login'))
+    if session.get('auth_version') != state['version']:
+        session['role'] = state['role']
+        session['auth_version'] = state['version']
+    return state, None
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'username' not in session:
             flash('Please login to access this page', 'error')
             return redirect(url_for('login'))
+        _, response = _session_auth_state()
+        if response is not None:
+            return response
         return f(*args, **kwargs)
     return decorated_function
 
@@ -389,8 +3060,10 @@ def admin_required(f):
         if 'username' not in session:
             flash('Please login to access this page', 'error')
             return redirect(url_for('login'))
-        users = load_users()
-        if users[session['username']]['role'] != 'admin':
+        state, response = _session_auth_state()
+        if response is not None:
+            return response
+        if state['role'] != 'admin':
             flash('Admin access required', 'error')
             return redirect(url_for('dashboard'))
         return f(*args, **kwargs)
@@ -413,6 +3086,9 @@ def login():
         password = request.form.get('password')
         
         users = load_users()
+        if username not in users:
+            # Allow signing in with the account email as well
+            username = find_user_by_email(username) or username
         if username in users:
             user = users[username]
             if user.get('banned'):
@@ -424,6 +3100,7 @@ def login():
             if check_password_hash(user['password'], password):
                 session['username'] = username
                 session['role'] = user['role']
+                session['auth_version'] = user.get('auth_version', 0)
                 session['theme'] = user.get('theme', 'dark')
                 flash('Login successful!', 'success')
                 return redirect(url_for('dashboard'))
@@ -453,12 +3130,11 @@ def register():
             flash('Username already exists', 'error')
             return redirect(url_for('register'))
         
-        for user in users.values():
-            if user['email'] == email:
-                flash('Email already registered', 'error')
-                return redirect(url_for('register'))
+        if email_taken(email):
+            flash('Email already registered', 'error')
+            return redirect(url_for('register'))
         
-        users[username] = {
+        add_user(username, {
             "username": username,
             "email": email,
             "password": generate_password_hash(password),
@@ -468,8 +3144,7 @@ def register():
             "banned": False,
             "suspended": False,
             "balance": 0.0
-        }
-        save_users(users)
+        })
         
         flash('Registration successful! Please login.', 'success')
         return redirect(url_for('login'))
@@ -493,21 +3168,7 @@ def dashboard():
     settings = load_settings()
     
     user_vps = vps_data.get(username, [])
-    
-    # Calculate totals
-    total_ram = 0
-    total_cpu = 0
-    total_disk = 0
-    active_vps = 0
-    
-    for vps in user_vps:
-        ram_gb = int(vps['ram'].replace('GB', ''))
-        disk_gb = int(vps['storage'].replace('GB', ''))
-        total_ram += ram_gb
-        total_cpu += int(vps['cpu'])
-        total_disk += disk_gb
-        if vps.get('status') == 'running' and not vps.get('suspended'):
-            active_vps += 1
+    totals = get_vps_totals(username)
     
     uptime = get_uptime()
     
@@ -515,10 +3176,10 @@ def dashboard():
                          user=user, 
                          balance=user['balance'],  # Explicitly pass balance for display
                          vps_list=user_vps,
-                         total_ram=total_ram,
-                         total_cpu=total_cpu,
-                         total_disk=total_disk,
-                         active_vps=active_vps,
+                         total_ram=totals['ram_mb'] // 1024,
+                         total_cpu=totals['cpu'],
+                         total_disk=totals['disk_gb'],
+                         active_vps=totals['running'],
                          uptime=uptime,
                          settings=settings,
                          current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
@@ -529,51 +3190,34 @@ def manage_vps(vps_id):
     username = session['username']
     users = load_users()
     user = users[username]
-    vps_data = load_vps_data()
     settings = load_settings()
     
-    user_vps = vps_data.get(username, [])
-    vps = None
-    
-    for v in user_vps:
-        if v['container_name'] == vps_id:
-            vps = v
-            break
+    owner, vps = find_vps(vps_id)
     
-    if not vps:
+    if not vps or owner != username:
         flash('VPS not found', 'error')
         return redirect(url_for('dashboard'))
     
-    # Get live stats
-    status = get_container_status(vps_id)
-    cpu_usage = get_container_cpu(vps_id)
-    memory_usage = get_container_memory(vps_id)
-    disk_usage = get_container_disk(vps_id)
+    # Latest stats sample
+    stats, stats_age = get_container_stats(vps_id)
     
     return render_template('manage_vps.html',
                          user=user,
                          vps=vps,
-                         status=status,
-                         cpu_usage=cpu_usage,
-                         memory_usage=memory_usage,
-                         disk_usage=disk_usage,
+                         status=stats['status'],
+                         cpu_usage=stats['cpu'],
+                         memory_usage=stats['memory'],
+                         disk_usage=stats['disk'],
+                         stats_age=stats_age,
                          settings=settings)
 
 @app.route('/vps/action/<vps_id>/<action>', methods=['POST'])
 @login_required
 def vps_action(vps_id, action):
     username = session['username']
-    vps_data = load_vps_data()
-    
-    user_vps = vps_data.get(username, [])
-    vps = None
-    
-    for v in user_vps:
-        if v['container_name'] == vps_id:
-            vps = v
-            break
+    owner, vps = find_vps(vps_id)
     
-    if not vps:
+    if not vps or owner != username:
         return jsonify({'success': False, 'message': 'VPS not found'})
     
     if vps.get('suspended') and action != 'stats':
@@ -581,57 +3225,30 @@ def vps_action(vps_id, action):
     
     try:
         if action == 'start':
-            execute_lxc_sync(f"lxc start {vps_id}")
-            vps['status'] = 'running'
-            save_vps_data(vps_data)
+            lxc_set_state(vps_id, 'start')
+            update_vps(vps_id, status='running')
             return jsonify({'success': True, 'message': 'VPS started successfully'})
         
         elif action == 'stop':
-            execute_lxc_sync(f"lxc stop {vps_id}")
-            vps['status'] = 'stopped'
-            save_vps_data(vps_data)
+            lxc_set_state(vps_id, 'stop')
+            update_vps(vps_id, status='stopped')
             return jsonify({'success': True, 'message': 'VPS stopped successfully'})
         
         elif action == 'restart':
-            execute_lxc_sync(f"lxc restart {vps_id}")
-            vps['status'] = 'running'
-            save_vps_data(vps_data)
+            lxc_set_state(vps_id, 'restart')
+            update_vps(vps_id, status='running')
             return jsonify({'success': True, 'message': 'VPS restarted successfully'})
         
         elif action == 'stats':
-            stats = {
-                'status': get_container_status(vps_id),
-                'cpu': get_container_cpu(vps_id),
-                'memory': get_container_memory(vps_id),
-                'disk': get_container_disk(vps_id)
-            }
-            return jsonify({'success': True, 'stats': stats})
+            stats, age = get_container_stats(vps_id)
+            return jsonify({'success': True, 'stats': stats, 'age': age})
         
         elif action == 'ssh':
-            # Install tmate if not exists
+            # Reuses a live tmate session or starts one
             try:
-                execute_lxc_sync(f"lxc exec {vps_id} -- which tmate")
-            except:
-                execute_lxc_sync(f"lxc exec {vps_id} -- sudo apt-get update -y")
-                execute_lxc_sync(f"lxc exec {vps_id} -- sudo apt-get install tmate -y")
-            
-            # Create SSH session
-            session_name = f"svm-session-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            execute_lxc_sync(f"lxc exec {vps_id} -- tmate -S /tmp/{session_name}.sock new-session -d")
-            time.sleep(3)
-            
-            # Get SSH link
-            result = subprocess.run(
-                ["lxc", "exec", vps_id, "--", "tmate", "-S", f"/tmp/{session_name}.sock", "display", "-p", "#{tmate_ssh}"],
-                capture_output=True,
-                text=True
-            )
-            ssh_url = result.stdout.strip() if result.stdout else None
-            
-            if ssh_url:
-                return jsonify({'success': True, 'ssh_url': ssh_url})
-            else:
-                return jsonify({'success': False, 'message': 'Failed to generate SSH link'})
+                return jsonify({'success': True, 'ssh_url': get_ssh_session(vps_id, 'owner', username)})
+            except SSHSessionPending as e:
+                return jsonify({'success': False, 'pending': True, 'message': str(e)})
         
         else:
             return jsonify({'success': False, 'message': 'Invalid action'})
@@ -639,6 +3256,85 @@ def vps_action(vps_id, action):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/vps/stats/stream')
+@login_required
+def vps_stats_stream():
+    """Server-Sent Events stream of stats of the user's VPS (?vps= to pick some)"""
+    username = session['username']
+    container_names = get_user_containers(username)
+    wanted = request.args.getlist('vps')
+    if wanted:
+        container_names = [name for name in container_names if name in wanted]
+    
+    if not container_names:
+        return jsonify({'success': False, 'message': 'VPS not found'})
+    
+    def event(container_name, entry):
+        data = json.dumps({
+            'vps': container_name,
+            'stats': entry['stats'],
+            'age': round(time.monotonic() - entry['sampled_at'], 1)
+        })
+        return f"event: stats\ndata: {data}\n\n"
+    
+    def stream():
+        subscriber = subscribe_stats(container_names)
+        closes_at = time.monotonic() + STATS_STREAM_LIFETIME
+        try:
+            # EventSource reconnects this long after the stream ends
+            yield "retry: 1000\n\n"
+            with _stats_cache_lock:
+                current = [(name, _stats_cache.get(name)) for name in container_names]
+            for name, entry in current:
+                if entry is not None:
+                    yield event(name, entry)
+            while True:
+                remaining = closes_at - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    name, entry = subscriber.get(timeout=min(remaining, 15))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield event(name, entry)
+        finally:
+            unsubscribe_stats(subscriber, container_names)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/vps/<vps_id>/history')
+@login_required
+def vps_history(vps_id):
+    """Stats history of a VPS between ?since= and ?until= (unix timestamps)"""
+    username = session['username']
+    owner, vps = find_vps(vps_id)
+    
+    if not vps or owner != username:
+        return jsonify({'success': False, 'message': 'VPS not found'})
+    
+    try:
+        since = int(request.args.get('since', time.time() - 3600))
+        until = int(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid time range'})
+    
+    resolution = request.args.get('resolution') or None
+    if resolution and resolution not in [name for name, _, _ in HISTORY_RESOLUTIONS]:
+        return jsonify({'success': False, 'message': 'Invalid resolution'})
+    
+    refresh_stats_history()
+    resolution, points = stats_history.query(vps_id, since, until, resolution)
+    return jsonify({
+        'success': True,
+        'resolution': resolution,
+        'metrics': list(HISTORY_METRICS),
+        'points': points
+    })
+
 @app.route('/plans')
 @login_required
 def plans():
@@ -665,14 +3361,15 @@ def buy_plan(plan_key):
     # Generate buy ID
     buy_id = ''.join([str(secrets.randbelow(10)) for _ in range(10)])
     
-    pending_payments = load_pending_payments()
-    pending_payments[buy_id] = {
-        "user": username,
-        "plan": plan_key,
-        "status": "pending",
-        "created_at": datetime.now().isoformat()
-    }
-    save_pending_payments(pending_payments)
+    with data_transaction(PENDING_PAYMENTS_FILE):
+        pending_payments = load_pending_payments()
+        pending_payments[buy_id] = {
+            "user": username,
+            "plan": plan_key,
+            "status": "pending",
+            "created_at": datetime.now().isoformat()
+        }
+        save_pending_payments(pending_payments)
     
     flash(f'Your Buy ID: {buy_id}. Please send payment and submit proof.', 'success')
     return redirect(url_for('payment_proof', buy_id=buy_id))
@@ -712,9 +3409,7 @@ def payment_proof(buy_id):
             filepath = os.path.join('static/uploads/payments', filename)
             file.save(filepath)
             
-            payment['screenshot'] = filepath
-            payment['status'] = 'submitted'
-            save_pending_payments(pending_payments)
+            update_payment(buy_id, screenshot=filepath, status='submitted')
             
             flash('Payment proof submitted! Waiting for admin approval.', 'success')
             return redirect(url_for('dashboard'))
@@ -738,15 +3433,20 @@ def profile():
         theme = request.form.get('theme')
         new_password = request.form.get('new_password')
         
+        if email and email_taken(email, exclude_username=username):
+            flash('Email already registered', 'error')
+            return redirect(url_for('profile'))
+        
+        updates = {}
         if email:
-            user['email'] = email
+            updates['email'] = email
         if theme:
-            user['theme'] = theme
+            updates['theme'] = theme
             session['theme'] = theme
         if new_password:
-            user['password'] = generate_password_hash(new_password)
+            updates['password'] = generate_password_hash(new_password)
         
-        save_users(users)
+        update_user(username, **updates)
         flash('Profile updated successfully', 'success')
         return redirect(url_for('profile'))
     
@@ -762,39 +3462,21 @@ def admin_panel():
     users = load_users()
     user = users[username]
     settings = load_settings()
-    vps_data = load_vps_data()
-    pending_payments = load_pending_payments()
     
     # Calculate stats
-    total_users = len(users)
-    total_vps = sum(len(vps_list) for vps_list in vps_data.values())
-    total_ram = 0
-    total_cpu = 0
-    total_disk = 0
-    running_vps = 0
-    
-    for vps_list in vps_data.values():
-        for vps in vps_list:
-            ram_gb = int(vps['ram'].replace('GB', ''))
-            disk_gb = int(vps['storage'].replace('GB', ''))
-            total_ram += ram_gb
-            total_cpu += int(vps['cpu'])
-            total_disk += disk_gb
-            if vps.get('status') == 'running' and not vps.get('suspended'):
-                running_vps += 1
-    
-    pending_count = len([p for p in pending_payments.values() if p['status'] == 'submitted'])
+    totals = get_vps_totals()
     
     return render_template('admin/dashboard.html',
                          user=user,
                          settings=settings,
-                         total_users=total_users,
-                         total_vps=total_vps,
-                         total_ram=total_ram,
-                         total_cpu=total_cpu,
-                         total_disk=total_disk,
-                         running_vps=running_vps,
-                         pending_count=pending_count,
+                         total_users=len(users),
+                         total_vps=totals['vps'],
+                         total_ram=totals['ram_mb'] // 1024,
+                         total_cpu=totals['cpu'],
+                         total_disk=totals['disk_gb'],
+                         running_vps=totals['running'],
+                         pending_count=count_payments('submitted'),
+                         warm_pool=warm_pool_status() if warm_pool_enabled() else None,
                          uptime=get_uptime())
 
 @app.route('/admin/users', methods=['GET', 'POST'])
@@ -820,10 +3502,10 @@ def admin_users():
                 flash('All fields are required.', 'error')
             elif new_username in users:
                 flash('Username already exists.', 'error')
-            elif any(u['email'] == email for u in users.values()):
+            elif email_taken(email):
                 flash('Email already exists.', 'error')
             else:
-                users[new_username] = {
+                add_user(new_username, {
                     "username": new_username,
                     "email": email,
                     "password": generate_password_hash(password),
@@ -833,8 +3515,7 @@ def admin_users():
                     "banned": False,
                     "suspended": False,
                     "balance": 0.0
-                }
-                save_users(users)
+                })
                 flash(f'User {new_username} added successfully', 'success')
                 return redirect(url_for('admin_users'))
         
@@ -844,8 +3525,9 @@ def admin_users():
             try:
                 amount = float(amount_str)
                 if target_username in users and amount > 0:
-                    users[target_username]['balance'] += amount
-                    save_users(users)
+                    with data_transaction(USERS_FILE):
+                        balance = load_users()[target_username]['balance']
+                        update_user(target_username, balance=balance + amount)
                     return jsonify({'success': True, 'message': f'Added ₹{amount} to {target_username}\'s balance.'})
                 else:
                     return jsonify({'success': False, 'message': 'Invalid user or amount.'})
@@ -861,28 +3543,26 @@ def admin_users():
             if target_username not in users:
                 return jsonify({'success': False, 'message': 'User not found.'})
             
-            updated = False
+            if new_role == 'user' and target_username == session['username']:
+                return jsonify({'success': False, 'message': 'Cannot demote yourself.'})
+            
+            updates = {}
             
             if new_email:
                 # Check email uniqueness excluding self
-                if any(u['email'] == new_email for u_name, u in users.items() if u_name != target_username):
+                if email_taken(new_email, exclude_username=target_username):
                     return jsonify({'success': False, 'message': 'Email already exists.'})
-                users[target_username]['email'] = new_email
-                updated = True
+                updates['email'] = new_email
             
             if new_role and new_role in ['user', 'admin']:
-                if new_role == 'user' and target_username == session['username']:
-                    return jsonify({'success': False, 'message': 'Cannot demote yourself.'})
                 if users[target_username]['role'] != new_role:
-                    users[target_username]['role'] = new_role
-                    updated = True
+                    updates['role'] = new_role
             
             if new_password:
-                users[target_username]['password'] = generate_password_hash(new_password)
-                updated = True
+                updates['password'] = generate_password_hash(new_password)
             
-            if updated:
-                save_users(users)
+            if updates:
+                update_user(target_username, **updates)
                 return jsonify({'success': True, 'message': 'User updated successfully.'})
             else:
                 return jsonify({'success': False, 'message': 'No changes made.'})
@@ -891,17 +3571,16 @@ def admin_users():
             target_username = request.form.get('username')
             if target_username in users and users[target_username]['role'] != 'admin':
                 # Delete VPS first
-                vps_data = load_vps_data()
-                if target_username in vps_data:
-                    for vps in vps_data[target_username]:
-                        try:
-                            execute_lxc_sync(f"lxc delete {vps['container_name']} --force")
-                        except:
-                            pass
-                    del vps_data[target_username]
-                    save_vps_data(vps_data)
-                del users[target_username]
-                save_users(users)
+                for container_name in get_user_containers(target_username):
+                    try:
+                        lxc_delete(container_name)
+                    except:
+                        pass
+                    remove_vps(container_name)
+                with data_transaction(USERS_FILE):
+                    users = load_users()
+                    users.pop(target_username, None)
+                    save_users(users)
                 return jsonify({'success': True, 'message': f'User {target_username} deleted.'})
             else:
                 return jsonify({'success': False, 'message': 'Cannot delete admin or invalid user.'})
@@ -914,8 +3593,7 @@ def admin_users():
                     return jsonify({'success': False, 'message': 'No change needed.'})
                 if target_role == 'user' and target_username == session['username']:
                     return jsonify({'success': False, 'message': 'Cannot demote yourself.'})
-                users[target_username]['role'] = target_role
-                save_users(users)
+                update_user(target_username, role=target_role)
                 # Update session if self
                 if target_username == session['username']:
                     session['role'] = target_role
@@ -938,10 +3616,12 @@ def admin_users():
 @app.route('/admin/users/delete/<target_username>')
 @admin_required
 def admin_delete_user(target_username):
-    users = load_users()
-    if target_username in users:
-        del users[target_username]
-        save_users(users)
+    with data_transaction(USERS_FILE):
+        users = load_users()
+        found = users.pop(target_username, None) is not None
+        if found:
+            save_users(users)
+    if found:
         flash(f'User {target_username} deleted successfully', 'success')
     else:
         flash('User not found', 'error')
@@ -950,10 +3630,7 @@ def admin_delete_user(target_username):
 @app.route('/admin/users/ban/<target_username>')
 @admin_required
 def admin_ban_user(target_username):
-    users = load_users()
-    if target_username in users:
-        users[target_username]['banned'] = True
-        save_users(users)
+    if update_user(target_username, banned=True):
         flash(f'User {target_username} banned', 'success')
     else:
         flash('User not found', 'error')
@@ -962,10 +3639,7 @@ def admin_ban_user(target_username):
 @app.route('/admin/users/unban/<target_username>')
 @admin_required
 def admin_unban_user(target_username):
-    users = load_users()
-    if target_username in users:
-        users[target_username]['banned'] = False
-        save_users(users)
+    if update_user(target_username, banned=False):
         flash(f'User {target_username} unbanned', 'success')
     else:
         flash('User not found', 'error')
@@ -974,10 +3648,7 @@ def admin_unban_user(target_username):
 @app.route('/admin/users/suspend/<target_username>')
 @admin_required
 def admin_suspend_user(target_username):
-    users = load_users()
-    if target_username in users:
-        users[target_username]['suspended'] = True
-        save_users(users)
+    if update_user(target_username, suspended=True):
         flash(f'User {target_username} suspended', 'success')
     else:
         flash('User not found', 'error')
@@ -986,10 +3657,7 @@ def admin_suspend_user(target_username):
 @app.route('/admin/users/unsuspend/<target_username>')
 @admin_required
 def admin_unsuspend_user(target_username):
-    users = load_users()
-    if target_username in users:
-        users[target_username]['suspended'] = False
-        save_users(users)
+    if update_user(target_username, suspended=False):
         flash(f'User {target_username} unsuspended', 'success')
     else:
         flash('User not found', 'error')
@@ -1003,6 +3671,8 @@ def admin_vps():
     user = users[username]
     settings = load_settings()
     vps_data = load_vps_data()
+    live_state = get_fleet_state()
+    jobs = recent_jobs()
     
     # Pass all users including admins for select dropdown
     all_users = {k: v for k, v in users.items()}
@@ -1011,6 +3681,8 @@ def admin_vps():
                          user=user,
                          settings=settings,
                          vps_data=vps_data,
+                         live_state=live_state,
+                         jobs=jobs,
                          users=users,
                          all_users=all_users,  # Explicitly pass all users including admins
                          os_options=OS_OPTIONS)  # Pass OS options for template
@@ -1024,43 +3696,29 @@ def admin_create_vps():
     cpu = int(request.form.get('cpu'))
     disk = int(request.form.get('disk'))
     os_key = request.form.get('os', 'ubuntu2204')  # Default to Ubuntu 22.04
+    if os_key not in OS_OPTIONS:
+        os_key = 'ubuntu2204'
     
-    os_image = OS_OPTIONS.get(os_key, 'ubuntu:22.04')
-    
-    vps_data = load_vps_data()
-    if target_username not in vps_data:
-        vps_data[target_username] = []
-    
-    vps_count = len(vps_data[target_username]) + 1
-    container_name = f"svm-{hostname}-{vps_count}" if hostname else f"svm-vps-{target_username}-{vps_count}"
+    # Skip names taken by existing VPS or by creations still queued
+    vps_count = len(get_user_containers(target_username)) + 1
+    while True:
+        container_name = f"svm-{hostname}-{vps_count}" if hostname else f"svm-vps-{target_username}-{vps_count}"
+        if not find_vps(container_name)[1] and not active_job(container_name):
+            break
+        vps_count += 1
     ram_mb = ram * 1024
     
     try:
-        execute_lxc_sync(f"lxc init {os_image} {container_name} --storage {DEFAULT_STORAGE_POOL}")
-        execute_lxc_sync(f"lxc config set {container_name} limits.memory {ram_mb}MB")
-        execute_lxc_sync(f"lxc config set {container_name} limits.cpu {cpu}")
-        execute_lxc_sync(f"lxc config device set {container_name} root size {disk}GB")
-        execute_lxc_sync(f"lxc start {container_name}")
-        
-        config_str = f"{ram}GB RAM / {cpu} CPU / {disk}GB Disk"
-        vps_info = {
-            "container_name": container_name,
-            "hostname": hostname or container_name,
-            "ram": f"{ram}GB",
-            "cpu": str(cpu),
-            "storage": f"{disk}GB",
-            "config": config_str,
-            "status": "running",
-            "suspended": False,
-            "suspension_history": [],
-            "created_at": datetime.now().isoformat(),
-            "shared_with": [],
-            "os": os_key  # Store selected OS
-        }
-        vps_data[target_username].append(vps_info)
-        save_vps_data(vps_data)
-        
-        flash(f'VPS {container_name} created successfully for {target_username}', 'success')
+        job = enqueue_job('create_vps', {
+            'owner': target_username,
+            'container_name': container_name,
+            'hostname': hostname or container_name,
+            'ram_mb': ram_mb,
+            'cpu': cpu,
+            'disk_gb': disk,
+            'os_key': os_key
+        }, f"Create {container_name} for {target_username}")
+        flash(f'VPS {container_name} is being created for {target_username} (job {job["id"]})', 'success')
     except Exception as e:
         flash(f'Failed to create VPS: {str(e)}', 'error')
     
@@ -1069,129 +3727,96 @@ def admin_create_vps():
 @app.route('/admin/vps/delete/<owner>/<vps_id>')
 @admin_required
 def admin_delete_vps(owner, vps_id):
-    vps_data = load_vps_data()
-    if owner in vps_data:
-        user_vps = vps_data[owner]
-        for i, vps in enumerate(user_vps):
-            if vps['container_name'] == vps_id:
-                try:
-                    execute_lxc_sync(f"lxc delete {vps_id} --force")
-                    del user_vps[i]
-                    save_vps_data(vps_data)
-                    flash(f'VPS {vps_id} deleted successfully', 'success')
-                except Exception as e:
-                    flash(f'Failed to delete VPS: {str(e)}', 'error')
-                break
+    vps_owner, vps = find_vps(vps_id)
+    if vps and vps_owner == owner:
+        if active_job(vps_id):
+            flash(f'VPS {vps_id} has a job in progress', 'error')
+            return redirect(url_for('admin_vps'))
+        try:
+            job = enqueue_job('delete_vps', {'container_name': vps_id}, f"Delete {vps_id}")
+            flash(f'VPS {vps_id} is being deleted (job {job["id"]})', 'success')
+        except Exception as e:
+            flash(f'Failed to delete VPS: {str(e)}', 'error')
     return redirect(url_for('admin_vps'))
 
 @app.route('/admin/vps/suspend/<owner>/<vps_id>', methods=['POST'])
 @admin_required
 def admin_suspend_vps(owner, vps_id):
     reason = request.form.get('reason', 'Admin action')
-    vps_data = load_vps_data()
+    vps_owner, vps = find_vps(vps_id)
     
-    if owner in vps_data:
-        for vps in vps_data[owner]:
-            if vps['container_name'] == vps_id:
-                try:
-                    execute_lxc_sync(f"lxc stop {vps_id}")
-                    vps['status'] = 'suspended'
-                    vps['suspended'] = True
-                    if 'suspension_history' not in vps:
-                        vps['suspension_history'] = []
-                    vps['suspension_history'].append({
-                        'time': datetime.now().isoformat(),
-                        'reason': reason,
-                        'by': session['username']
-                    })
-                    save_vps_data(vps_data)
-                    flash(f'VPS {vps_id} suspended', 'success')
-                except Exception as e:
-                    flash(f'Failed to suspend VPS: {str(e)}', 'error')
-                break
+    if vps and vps_owner == owner:
+        try:
+            lxc_set_state(vps_id, 'stop')
+            with data_transaction(VPS_FILE):
+                _, vps = find_vps(vps_id)
+                suspension_history = vps.get('suspension_history', []) + [{
+                    'time': datetime.now().isoformat(),
+                    'reason': reason,
+                    'by': session['username']
+                }]
+                update_vps(vps_id, status='suspended', suspended=True,
+                           suspension_history=suspension_history)
+            flash(f'VPS {vps_id} suspended', 'success')
+        except Exception as e:
+            flash(f'Failed to suspend VPS: {str(e)}', 'error')
     return redirect(url_for('admin_vps'))
 
 @app.route('/admin/vps/unsuspend/<owner>/<vps_id>')
 @admin_required
 def admin_unsuspend_vps(owner, vps_id):
-    vps_data = load_vps_data()
+    vps_owner, vps = find_vps(vps_id)
     
-    if owner in vps_data:
-        for vps in vps_data[owner]:
-            if vps['container_name'] == vps_id:
-                try:
-                    execute_lxc_sync(f"lxc start {vps_id}")
-                    vps['status'] = 'running'
-                    vps['suspended'] = False
-                    save_vps_data(vps_data)
-                    flash(f'VPS {vps_id} unsuspended', 'success')
-                except Exception as e:
-                    flash(f'Failed to unsuspend VPS: {str(e)}', 'error')
-                break
+    if vps and vps_owner == owner:
+        try:
+            lxc_set_state(vps_id, 'start')
+            update_vps(vps_id, status='running', suspended=False)
+            flash(f'VPS {vps_id} unsuspended', 'success')
+        except Exception as e:
+            flash(f'Failed to unsuspend VPS: {str(e)}', 'error')
     return redirect(url_for('admin_vps'))
 
 @app.route('/admin/vps/action/<owner>/<vps_id>/<action>', methods=['POST'])
 @admin_required
 def admin_vps_action(owner, vps_id, action):
     """Handle VPS control actions from admin panel"""
-    vps_data = load_vps_data()
-    
-    if owner not in vps_data:
+    if not get_user_containers(owner):
         return jsonify({'success': False, 'message': 'User not found'})
     
-    vps = None
-    for v in vps_data[owner]:
-        if v['container_name'] == vps_id:
-            vps = v
-            break
+    vps_owner, vps = find_vps(vps_id)
     
-    if not vps:
+    if not vps or vps_owner != owner:
         return jsonify({'success': False, 'message': 'VPS not found'})
     
     try:
         if action == 'start':
-            execute_lxc_sync(f"lxc start {vps_id}")
-            vps['status'] = 'running'
-            save_vps_data(vps_data)
+            lxc_set_state(vps_id, 'start')
+            update_vps(vps_id, status='running')
             return jsonify({'success': True, 'message': 'VPS started successfully'})
         
         elif action == 'stop':
-            execute_lxc_sync(f"lxc stop {vps_id}")
-            vps['status'] = 'stopped'
-            save_vps_data(vps_data)
+            lxc_set_state(vps_id, 'stop')
+            update_vps(vps_id, status='stopped')
             return jsonify({'success': True, 'message': 'VPS stopped successfully'})
         
         elif action == 'restart':
-            execute_lxc_sync(f"lxc restart {vps_id}")
-            vps['status'] = 'running'
-            save_vps_data(vps_data)
+            lxc_set_state(vps_id, 'restart')
+            update_vps(vps_id, status='running')
             return jsonify({'success': True, 'message': 'VPS restarted successfully'})
         
         elif action == 'reinstall':
             # Get OS from form, default to ubuntu:22.04
             os_key = request.form.get('os', 'ubuntu2204')
-            os_image = OS_OPTIONS.get(os_key, 'ubuntu:22.04')
-            
-            # Backup current config
-            ram = vps['ram']
-            cpu = vps['cpu']
-            disk = vps['storage']
-            
-            # Delete and recreate
-            execute_lxc_sync(f"lxc delete {vps_id} --force")
-            execute_lxc_sync(f"lxc init {os_image} {vps_id} --storage {DEFAULT_STORAGE_POOL}")
+            if os_key not in OS_OPTIONS:
+                os_key = 'ubuntu2204'
             
-            # Reapply config
-            ram_mb = int(ram.replace('GB', '')) * 1024
-            execute_lxc_sync(f"lxc config set {vps_id} limits.memory {ram_mb}MB")
-            execute_lxc_sync(f"lxc config set {vps_id} limits.cpu {cpu}")
-            execute_lxc_sync(f"lxc config device set {vps_id} root size {disk}")
-            execute_lxc_sync(f"lxc start {vps_id}")
+            if active_job(vps_id):
+                return jsonify({'success': False, 'message': 'VPS has a job in progress'})
             
-            vps['status'] = 'running'
-            vps['os'] = os_key  # Update OS
-            save_vps_data(vps_data)
-            return jsonify({'success': True, 'message': 'VPS reinstalled successfully'})
+            # Delete and recreate in the background
+            job = enqueue_job('reinstall_vps', {'container_name': vps_id, 'os_key': os_key},
+                              f"Reinstall {vps_id} with {os_key}")
+            return jsonify({'success': True, 'message': 'VPS reinstall started', 'job_id': job['id']})
         
         else:
             return jsonify({'success': False, 'message': 'Invalid action'})
@@ -1204,31 +3829,26 @@ def admin_vps_action(owner, vps_id, action):
 def admin_vps_details(owner, vps_id):
     """Get detailed VPS statistics"""
     try:
-        status = get_container_status(vps_id)
-        cpu = get_container_cpu(vps_id)
-        memory = get_container_memory(vps_id)
-        disk = get_container_disk(vps_id)
+        stats, age = get_container_stats(vps_id)
         
         # Get uptime
         try:
-            result = subprocess.run(
-                ['lxc', 'exec', vps_id, '--', 'uptime', '-p'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            uptime = result.stdout.strip()
+            _, output, _ = lxc_exec(vps_id, ['uptime', '-p'], timeout=10)
+            uptime = output.strip()
         except:
             uptime = 'Unknown'
         
         return jsonify({
             'success': True,
             'details': {
-                'status': status,
-                'cpu': cpu,
-                'memory': memory,
-                'disk': disk,
-                'uptime': uptime
+                'status': stats['status'],
+                'cpu': stats['cpu'],
+                'memory': stats['memory'],
+                'disk': stats['disk'],
+                'io': stats['io'],
+                'uptime': uptime,
+                'age': age,
+                'ssh_sessions': count_ssh_sessions(vps_id)
             }
         })
     except Exception as e:
@@ -1239,25 +3859,12 @@ def admin_vps_details(owner, vps_id):
 def admin_vps_ssh(owner, vps_id):
     """Generate SSH session for VPS"""
     try:
-        # Install tmate if not exists
-        try:
-            execute_lxc_sync(f"lxc exec {vps_id} -- which tmate")
-        except:
-            execute_lxc_sync(f"lxc exec {vps_id} -- sudo apt-get update -y", timeout=300)
-            execute_lxc_sync(f"lxc exec {vps_id} -- sudo apt-get install tmate -y", timeout=300)
-        
-        # Create SSH session
-        session_name = f"svm-session-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        execute_lxc_sync(f"lxc exec {vps_id} -- tmate -S /tmp/{session_name}.sock new-session -d")
-        time.sleep(3)
-        
-        # Get SSH command - Fixed f-string for tmate_ssh
-        ssh_cmd = execute_lxc_sync(f"lxc exec {vps_id} -- tmate -S /tmp/{session_name}.sock display -p '#{{tmate_ssh}}'")
-        
         return jsonify({
             'success': True,
-            'ssh_command': ssh_cmd
+            'ssh_command': get_ssh_session(vps_id, 'admin', session['username'])
         })
+    except SSHSessionPending as e:
+        return jsonify({'success': False, 'pending': True, 'message': str(e)})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -1269,46 +3876,28 @@ def admin_vps_resize(owner, vps_id):
     cpu = int(request.form.get('cpu'))
     disk = int(request.form.get('disk'))
     
-    vps_data = load_vps_data()
-    
-    if owner not in vps_data:
+    if not get_user_containers(owner):
         flash('User not found', 'error')
         return redirect(url_for('admin_vps'))
     
-    vps = None
-    for v in vps_data[owner]:
-        if v['container_name'] == vps_id:
-            vps = v
-            break
+    vps_owner, vps = find_vps(vps_id)
     
-    if not vps:
+    if not vps or vps_owner != owner:
         flash('VPS not found', 'error')
         return redirect(url_for('admin_vps'))
     
+    if active_job(vps_id):
+        flash(f'VPS {vps_id} has a job in progress', 'error')
+        return redirect(url_for('admin_vps'))
+    
     try:
-        # Stop VPS if running
-        was_running = vps.get('status') == 'running'
-        if was_running:
-            execute_lxc_sync(f"lxc stop {vps_id}")
-        
-        # Update resources
-        ram_mb = ram * 1024
-        execute_lxc_sync(f"lxc config set {vps_id} limits.memory {ram_mb}MB")
-        execute_lxc_sync(f"lxc config set {vps_id} limits.cpu {cpu}")
-        execute_lxc_sync(f"lxc config device set {vps_id} root size {disk}GB")
-        
-        # Restart if it was running
-        if was_running:
-            execute_lxc_sync(f"lxc start {vps_id}")
-        
-        # Update data
-        vps['ram'] = f"{ram}GB"
-        vps['cpu'] = str(cpu)
-        vps['storage'] = f"{disk}GB"
-        vps['config'] = f"{ram}GB RAM / {cpu} CPU / {disk}GB Disk"
-        save_vps_data(vps_data)
-        
-        flash(f'VPS {vps_id} resized successfully', 'success')
+        job = enqueue_job('resize_vps', {
+            'container_name': vps_id,
+            'ram_mb': ram * 1024,
+            'cpu': cpu,
+            'disk_gb': disk
+        }, f"Resize {vps_id}")
+        flash(f'VPS {vps_id} is being resized (job {job["id"]})', 'success')
     except Exception as e:
         flash(f'Failed to resize VPS: {str(e)}', 'error')
     
@@ -1317,7 +3906,7 @@ def admin_vps_resize(owner, vps_id):
 @app.route('/admin/vps/command/<owner>/<vps_id>', methods=['POST'])
 @admin_required
 def admin_vps_command(owner, vps_id):
-    """Execute command in VPS"""
+    """Execute command in VPS, with {"stream": true} the output is streamed"""
     try:
         data = request.get_json()
         command = data.get('command', '')
@@ -1325,15 +3914,22 @@ def admin_vps_command(owner, vps_id):
         if not command:
             return jsonify({'success': False, 'message': 'No command provided'})
         
+        owner_name, vps = find_vps(vps_id)
+        if not vps or owner_name != owner:
+            return jsonify({'success': False, 'message': 'VPS not found'})
+        
+        if data.get('stream'):
+            job = start_command(vps_id, command)
+            return jsonify({
+                'success': True,
+                'command_id': job['id'],
+                'stream_url': url_for('admin_vps_command_stream', command_id=job['id'])
+            })
+        
         # Execute command in container
-        result = subprocess.run(
-            ['lxc', 'exec', vps_id, '--', 'bash', '-c', command],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        _, stdout, stderr = lxc_exec(vps_id, ['bash', '-c', command], timeout=60)
         
-        output = result.stdout if result.stdout else result.stderr
+        output = stdout if stdout else stderr
         if not output:
             output = 'Command executed successfully (no output)'
         
@@ -1346,6 +3942,47 @@ def admin_vps_command(owner, vps_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/admin/vps/command/stream/<command_id>')
+@admin_required
+def admin_vps_command_stream(command_id):
+    """Server-Sent Events stream of a running command's output"""
+    job = get_command(command_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Command not found'})
+    
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        after = 0
+    
+    return Response(command_output_events(job, after), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/admin/vps/command/cancel/<command_id>', methods=['POST'])
+@admin_required
+def admin_vps_command_cancel(command_id):
+    """Cancel a running command"""
+    if cancel_command(command_id):
+        return jsonify({'success': True, 'message': 'Command cancelled'})
+    return jsonify({'success': False, 'message': 'Command is not running'})
+
+@app.route('/jobs/<job_id>')
+@admin_required
+def job_status(job_id):
+    """Status and progress of a background job"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'})
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/admin/warm-pool')
+@admin_required
+def admin_warm_pool():
+    """Warm pool fill levels, hit rate and refill latency"""
+    return jsonify({'success': True, 'warm_pool': warm_pool_status()})
+
 @app.route('/admin/payments')
 @admin_required
 def admin_payments():
@@ -1374,42 +4011,30 @@ def admin_approve_payment(buy_id):
     plan_data = VPS_PLANS[payment['plan']]
     target_user = payment['user']
     
-    vps_data = load_vps_data()
-    if target_user not in vps_data:
-        vps_data[target_user] = []
+    # Approving twice while the first VPS is still being created
+    job = get_job(payment['job_id']) if payment.get('job_id') else None
+    if job and job['status'] in ('queued', 'running'):
+        flash(f'Payment is already being processed (job {job["id"]})', 'error')
+        return redirect(url_for('admin_payments'))
     
     container_name = f"svm-vps-{target_user}-{int(time.time())}"
     ram_mb = plan_data['ram'] * 1024
-    os_image = OS_OPTIONS.get('ubuntu2204', 'ubuntu:22.04')  # Default OS for payments
     
     try:
-        execute_lxc_sync(f"lxc init {os_image} {container_name} --storage {DEFAULT_STORAGE_POOL}")
-        execute_lxc_sync(f"lxc config set {container_name} limits.memory {ram_mb}MB")
-        execute_lxc_sync(f"lxc config set {container_name} limits.cpu {plan_data['cpu']}")
-        execute_lxc_sync(f"lxc config device set {container_name} root size {plan_data['disk']}GB")
-        execute_lxc_sync(f"lxc start {container_name}")
-        
-        vps_data[target_user].append({
-            "container_name": container_name,
-            "hostname": container_name,
-            "ram": f"{plan_data['ram']}GB",
-            "cpu": str(plan_data['cpu']),
-            "storage": f"{plan_data['disk']}GB",
-            "config": f"{plan_data['ram']}GB RAM / {plan_data['cpu']} CPU / {plan_data['disk']}GB Disk",
-            "status": "running",
-            "suspended": False,
-            "suspension_history": [],
-            "created_at": datetime.now().isoformat(),
-            "shared_with": [],
-            "plan": plan_data['name'],
-            "os": 'ubuntu2204'  # Default OS
-        })
-        save_vps_data(vps_data)
-        
-        del pending_payments[buy_id]
-        save_pending_payments(pending_payments)
+        job = enqueue_job('create_vps', {
+            'owner': target_user,
+            'container_name': container_name,
+            'hostname': container_name,
+            'ram_mb': ram_mb,
+            'cpu': plan_data['cpu'],
+            'disk_gb': plan_data['disk'],
+            'os_key': 'ubuntu2204',  # Default OS for payments
+            'plan': plan_data['name'],
+            'buy_id': buy_id
+        }, f"Create {container_name} for {target_user} (payment {buy_id})")
+        update_payment(buy_id, job_id=job['id'])
         
-        flash(f'Payment approved and VPS created for {target_user}', 'success')
+        flash(f'Payment approved, VPS for {target_user} is being created (job {job["id"]})', 'success')
     except Exception as e:
         flash(f'Failed to create VPS: {str(e)}', 'error')
     
@@ -1418,10 +4043,12 @@ def admin_approve_payment(buy_id):
 @app.route('/admin/payments/reject/<buy_id>')
 @admin_required
 def admin_reject_payment(buy_id):
-    pending_payments = load_pending_payments()
-    if buy_id in pending_payments:
-        del pending_payments[buy_id]
-        save_pending_payments(pending_payments)
+    with data_transaction(PENDING_PAYMENTS_FILE):
+        pending_payments = load_pending_payments()
+        found = pending_payments.pop(buy_id, None) is not None
+        if found:
+            save_pending_payments(pending_payments)
+    if found:
         flash('Payment rejected', 'success')
     return redirect(url_for('admin_payments'))
 
@@ -1434,39 +4061,43 @@ def admin_settings():
     settings = load_settings()
     
     if request.method == 'POST':
-        panel_name = request.form.get('panel_name')
-        announcement = request.form.get('announcement')
-        
-        if panel_name:
-            settings['panel_name'] = panel_name
-        if announcement:
-            settings['announcement'] = announcement
-        
-        # Handle logo upload
-        if 'logo' in request.files:
-            file = request.files['logo']
-            if file.filename != '':
-                filename = secure_filename(file.filename)
-                filepath = os.path.join('static/uploads/logos', filename)
-                file.save(filepath)
-                settings['logo'] = f'/static/uploads/logos/{filename}'
-        
-        # Handle background upload
-        if 'background' in request.files:
-            file = request.files['background']
-            if file.filename != '':
-                filename = secure_filename(file.filename)
-                filepath = os.path.join('static/uploads/backgrounds', filename)
-                file.save(filepath)
-                settings['background'] = f'/static/uploads/backgrounds/{filename}'
-        
-        save_settings(settings)
+        with data_transaction(SETTINGS_FILE):
+            settings = load_settings()
+            panel_name = request.form.get('panel_name')
+            announcement = request.form.get('announcement')
+            
+            if panel_name:
+                settings['panel_name'] = panel_name
+            if announcement:
+                settings['announcement'] = announcement
+            
+            # Handle logo upload
+            if 'logo' in request.files:
+                file = request.files['logo']
+                if file.filename != '':
+                    filename = secure_filename(file.filename)
+                    filepath = os.path.join('static/uploads/logos', filename)
+                    file.save(filepath)
+                    settings['logo'] = f'/static/uploads/logos/{filename}'
+            
+            # Handle background upload
+            if 'background' in request.files:
+                file = request.files['background']
+                if file.filename != '':
+                    filename = secure_filename(file.filename)
+                    filepath = os.path.join('static/uploads/backgrounds', filename)
+                    file.save(filepath)
+                    settings['background'] = f'/static/uploads/backgrounds/{filename}'
+            
+            save_settings(settings)
         flash('Settings updated successfully', 'success')
         return redirect(url_for('admin_settings'))
     
     return render_template('admin/settings.html',
                          user=user,
-                         settings=settings)
+                         settings=settings,
+                         image_cache=image_cache_status(),
+                         image_cache_enabled=IMAGE_CACHE_ENABLED)
 
 
 if __name__ == '__main__':
@@ -1494,5 +4125,8 @@ if __name__ == '__main__':
 ╚═══════════════════════════════════════════════════════════════╝
     """)
     
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Under the reloader only the serving child runs them
+        start_background_services()
     app.run(host=host, port=port, debug=debug)
 
@@ -0,0 +1,268 @@
+"""Minimal LXD REST API client talking to the local LXD unix socket.
+
+Keeps one HTTP/1.1 keep-alive connection per thread so container operations
+don't pay for spawning the `lxc` CLI and a fresh socket connection each time.
+"""
+import json
+import os
+import socket
+import threading
+import http.client
+from urllib.parse import quote
+
+DEFAULT_SOCKET = '/var/snap/lxd/common/lxd/unix.socket'
+# Extra socket timeout on top of an operation wait's own timeout
+WAIT_MARGIN = 10
+# Requests that are safe to send again after a connection reset
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'))
+
+
+class LXDError(Exception):
+    """Error returned by the LXD API"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a unix domain socket"""
+
+    def __init__(self, socket_path, timeout=30):
+        super().__init__('lxd', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class LXDClient:
+    """Client for the subset of the LXD API the panel uses"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def available(self):
+        return os.path.exists(self.socket_path)
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            # Forked: the parent's connections belong to the parent
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _set_timeout(conn, timeout):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+    def request_raw(self, method, path, body=None, timeout=None):
+        """Send a request and return (HTTP status, response body bytes).
+
+        `timeout` overrides the socket timeout for this request only, for
+        calls that block on the server side like operation waits.
+        """
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        for attempt in range(2):
+            conn = self._connection()
+            reused = conn.sock is not None
+            sent = False
+            if timeout is not None:
+                self._set_timeout(conn, timeout)
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                sent = True
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError, http.client.CannotSendRequest):
+                # The kept-alive connection went away, reconnect once. A
+                # request that was sent may have been carried out, so only
+                # idempotent ones are sent again.
+                self.close()
+                if attempt or not reused or (sent and method not in IDEMPOTENT_METHODS):
+                    raise
+            except Exception:
+                self.close()
+                raise
+            finally:
+                if timeout is not None:
+                    self._set_timeout(conn, self.timeout)
+
+    def request(self, method, path, body=None, timeout=None):
+        """Send a request and return the decoded LXD response envelope"""
+        status, data = self.request_raw(method, path, body, timeout=timeout)
+        try:
+            response = json.loads(data)
+        except ValueError:
+            raise LXDError(f"Invalid response from LXD ({status})", status)
+        if response.get('type') == 'error':
+            raise LXDError(response.get('error') or 'LXD request failed',
+                           response.get('error_code', status))
+        return response
+
+    def wait(self, operation, timeout=60):
+        """Wait for a background operation and return its metadata"""
+        # The server holds the response for up to `timeout`, keep the socket open longer
+        response = self.request('GET', f"{operation}/wait?timeout={int(timeout)}",
+                                timeout=timeout + WAIT_MARGIN)
+        metadata = response.get('metadata') or {}
+        if metadata.get('status_code') == 103:
+            raise LXDError(f"Operation timed out after {int(timeout)} seconds", 103)
+        if metadata.get('status_code') != 200:
+            raise LXDError(metadata.get('err') or metadata.get('status') or 'Operation failed',
+                           metadata.get('status_code'))
+        return metadata
+
+    def _run(self, method, path, body=None, timeout=60):
+        response = self.request(method, path, body)
+        if response.get('type') == 'async':
+            return self.wait(response['operation'], timeout)
+        return response.get('metadata')
+
+    @staticmethod
+    def _instance(name):
+        return f"/1.0/instances/{quote(name, safe='')}"
+
+    # Instances
+    def create(self, name, source, config=None, devices=None, start=False, timeout=600):
+        """Create an instance with its config and devices, optionally starting it"""
+        return self._run('POST', '/1.0/instances', {
+            'name': name,
+            'source': source,
+            'config': config or {},
+            'devices': devices or {},
+            'start': start
+        }, timeout=timeout)
+
+    def list_instances(self):
+        """Return every instance with its state, in a single request"""
+        return self._run('GET', '/1.0/instances?recursion=2')
+
+    def state(self, name):
+        """Return the instance state (status, memory, cpu, disk, network)"""
+        return self._run('GET', f"{self._instance(name)}/state")
+
+    def status(self, name):
+        """Return the instance status, e.g. 'Running' or 'Stopped'"""
+        return self.state(name)['status']
+
+    def change_state(self, name, action, force=False, timeout=60):
+        return self._run('PUT', f"{self._instance(name)}/state", {
+            'action': action,
+            'timeout': timeout,
+            'force': force
+        }, timeout=timeout + 10)
+
+    def start(self, name, timeout=60):
+        return self.change_state(name, 'start', timeout=timeout)
+
+    def stop(self, name, force=False, timeout=60):
+        return self.change_state(name, 'stop', force=force, timeout=timeout)
+
+    def restart(self, name, force=False, timeout=60):
+        return self.change_state(name, 'restart', force=force, timeout=timeout)
+
+    def delete(self, name, timeout=60):
+        """Delete a stopped instance and its snapshots"""
+        return self._run('DELETE', self._instance(name), timeout=timeout)
+
+    def get(self, name):
+        """Return the instance definition (config, devices, profiles...)"""
+        return self._run('GET', self._instance(name))
+
+    def get_config(self, name):
+        return self.get(name).get('config', {})
+
+    def update(self, name, config=None, devices=None):
+        """Merge config keys and devices into the instance"""
+        body = {}
+        if config:
+            body['config'] = config
+        if devices:
+            body['devices'] = devices
+        return self._run('PATCH', self._instance(name), body)
+
+    def rename(self, name, new_name, timeout=60):
+        """Rename a stopped instance"""
+        return self._run('POST', self._instance(name), {'name': new_name}, timeout=timeout)
+
+    def snapshots(self, name):
+        """Return the names of the instance's snapshots"""
+        urls = self._run('GET', f"{self._instance(name)}/snapshots") or []
+        return [url.rsplit('/', 1)[-1] for url in urls]
+
+    def snapshot(self, name, snapshot, timeout=300):
+        return self._run('POST', f"{self._instance(name)}/snapshots", {'name': snapshot}, timeout=timeout)
+
+    def restore(self, name, snapshot, timeout=300):
+        """Restore the instance (rootfs, config and devices) from a snapshot"""
+        return self._run('PUT', self._instance(name), {'restore': snapshot}, timeout=timeout)
+
+    def exec(self, name, command, timeout=60):
+        """Run a command in the instance and return (exit code, stdout, stderr)"""
+        metadata = self._run('POST', f"{self._instance(name)}/exec", {
+            'command': list(command),
+            'record-output': True,
+            'interactive': False,
+            'wait-for-websocket': False
+        }, timeout=timeout)
+        result = metadata.get('metadata') or {}
+        outputs = result.get('output') or {}
+        stdout = self._read_log(outputs.get('1'))
+        stderr = self._read_log(outputs.get('2'))
+        return result.get('return', -1), stdout, stderr
+
+    # Images
+    def image_alias(self, alias):
+        """Return the fingerprint a local image alias points to"""
+        return self._run('GET', f"/1.0/images/aliases/{quote(alias, safe='')}")['target']
+
+    def image(self, fingerprint):
+        """Return a local image (size, uploaded_at, last_used_at...)"""
+        return self._run('GET', f"/1.0/images/{quote(fingerprint, safe='')}")
+
+    def copy_image(self, source, alias, auto_update=True, timeout=1800):
+        """Download a remote image into the local store under an alias"""
+        return self._run('POST', '/1.0/images', {
+            'source': source,
+            'aliases': [{'name': alias}],
+            'auto_update': auto_update
+        }, timeout=timeout)
+
+    def refresh_image(self, fingerprint, timeout=1800):
+        """Update a local image from its source if a newer one is available"""
+        return self._run('POST', f"/1.0/images/{quote(fingerprint, safe='')}/refresh", timeout=timeout)
+
+    # Storage
+    def storage_pool(self, pool):
+        """Return the storage pool definition (driver, config...)"""
+        return self._run('GET', f"/1.0/storage-pools/{quote(pool, safe='')}")
+
+    def _read_log(self, path):
+        if not path:
+            return ''
+        status, data = self.request_raw('GET', path)
+        if status != 200:
+            return ''
+        self.request_raw('DELETE', path)
+        return data.decode('utf-8', errors='replace')
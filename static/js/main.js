@@ -81,46 +81,58 @@ $(document).ready(function() {
     // ─────────────────────────────────────────────────────────────
     // VPS Stats Auto-Refresh
     // ─────────────────────────────────────────────────────────────
+    function showVPSStats(vpsId, stats) {
+        $(`#status-${vpsId}`).text(stats.status);
+        $(`#cpu-${vpsId}`).text(stats.cpu);
+        $(`#memory-${vpsId}`).text(stats.memory);
+        $(`#disk-${vpsId}`).text(stats.disk);
+        
+        // Update status badge
+        const statusBadge = $(`#status-badge-${vpsId}`);
+        statusBadge.removeClass('running stopped');
+        if (stats.status === 'Running') {
+            statusBadge.addClass('running');
+        } else {
+            statusBadge.addClass('stopped');
+        }
+    }
+
     function refreshVPSStats(vpsId) {
         $.ajax({
             url: `/vps/action/${vpsId}/stats`,
             method: 'POST',
             success: function(response) {
                 if (response.success) {
-                    const stats = response.stats;
-                    $(`#status-${vpsId}`).text(stats.status);
-                    $(`#cpu-${vpsId}`).text(stats.cpu);
-                    $(`#memory-${vpsId}`).text(stats.memory);
-                    $(`#disk-${vpsId}`).text(stats.disk);
-                    
-                    // Update status badge
-                    const statusBadge = $(`#status-badge-${vpsId}`);
-                    statusBadge.removeClass('running stopped');
-                    if (stats.status === 'Running') {
-                        statusBadge.addClass('running');
-                    } else {
-                        statusBadge.addClass('stopped');
-                    }
+                    showVPSStats(vpsId, response.stats);
                 }
             }
         });
     }
 
-    // Auto-refresh stats every 30 seconds
-    if ($('.vps-card').length) {
-        setInterval(() => {
-            $('.vps-card').each(function() {
-                const vpsId = $(this).data('vps-id');
-                if (vpsId) {
-                    refreshVPSStats(vpsId);
-                }
+    // Live stats for every VPS card over one event stream
+    const vpsIds = $('.vps-card').map(function() {
+        return $(this).data('vps-id');
+    }).get().filter(Boolean);
+    if (vpsIds.length) {
+        if (window.EventSource) {
+            const query = vpsIds.map(id => `vps=${encodeURIComponent(id)}`).join('&');
+            const statsStream = new EventSource(`/vps/stats/stream?${query}`);
+            statsStream.addEventListener('stats', function(event) {
+                const data = JSON.parse(event.data);
+                showVPSStats(data.vps, data.stats);
             });
-        }, 30000);
+        } else {
+            setInterval(() => vpsIds.forEach(refreshVPSStats), 30000);
+        }
     }
 
     // ─────────────────────────────────────────────────────────────
     // VPS Action Handlers
     // ─────────────────────────────────────────────────────────────
+    // While tmate is being installed the SSH action answers "pending"
+    const SSH_POLL_INTERVAL = 3000;
+    const SSH_POLL_ATTEMPTS = 60;
+
     $('.vps-action-btn').on('click', function(e) {
         e.preventDefault();
         const btn = $(this);
@@ -132,25 +144,32 @@ $(document).ready(function() {
         const originalHtml = btn.html();
         btn.html('<i class="fas fa-spinner fa-spin"></i> Processing...');
         
-        $.ajax({
-            url: `/vps/action/${vpsId}/${action}`,
-            method: 'POST',
-            success: function(response) {
-                if (response.success) {
-                    showNotification('success', response.message);
-                    setTimeout(() => location.reload(), 1500);
-                } else {
-                    showNotification('error', response.message);
+        function send(attempt) {
+            $.ajax({
+                url: `/vps/action/${vpsId}/${action}`,
+                method: 'POST',
+                success: function(response) {
+                    if (response.pending && attempt < SSH_POLL_ATTEMPTS) {
+                        // tmate is still being installed, ask again shortly
+                        btn.html('<i class="fas fa-spinner fa-spin"></i> Preparing SSH...');
+                        setTimeout(() => send(attempt + 1), SSH_POLL_INTERVAL);
+                    } else if (response.success) {
+                        showNotification('success', response.message || response.ssh_url);
+                        setTimeout(() => location.reload(), 1500);
+                    } else {
+                        showNotification('error', response.message);
+                        btn.prop('disabled', false);
+                        btn.html(originalHtml);
+                    }
+                },
+                error: function() {
+                    showNotification('error', 'An error occurred. Please try again.');
                     btn.prop('disabled', false);
                     btn.html(originalHtml);
                 }
-            },
-            error: function() {
-                showNotification('error', 'An error occurred. Please try again.');
-                btn.prop('disabled', false);
-                btn.html(originalHtml);
-            }
-        });
+            });
+        }
+        send(0);
     });
 
     // ─────────────────────────────────────────────────────────────
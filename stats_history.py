@@ -0,0 +1,267 @@
+"""Per-container time series of stats samples.
+
+Every container gets one fixed-size ring buffer per resolution: raw samples
+as they come from the sampler, plus 1 minute and 1 hour rollups that average
+the raw samples falling into each bucket. Rings are backed by flat arrays
+(uint32 timestamps, float32 values) and the whole store is persisted to a
+compact binary file.
+"""
+import array
+import logging
+import math
+import os
+import struct
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'VSTH'
+FORMAT_VERSION = 1
+
+# name -> (bucket seconds, capacity); raw is one row per sample
+RESOLUTIONS = (
+    ('raw', 0, 360),
+    ('1m', 60, 1440),
+    ('1h', 3600, 720),
+)
+
+
+class RingBuffer:
+    """Fixed-capacity ring of (timestamp, values...) rows"""
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.width = width
+        self.times = array.array('I', [0]) * capacity
+        self.values = array.array('f', [math.nan]) * (capacity * width)
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, values):
+        offset = self.head * self.width
+        self.times[self.head] = int(timestamp)
+        for i, value in enumerate(values):
+            self.values[offset + i] = math.nan if value is None else value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def oldest(self):
+        if not self.count:
+            return None
+        return self.times[(self.head - self.count) % self.capacity]
+
+    def rows(self, since=0, until=None):
+        """Rows in chronological order within [since, until]"""
+        start = (self.head - self.count) % self.capacity
+        for i in range(self.count):
+            index = (start + i) % self.capacity
+            timestamp = self.times[index]
+            if timestamp < since or (until is not None and timestamp > until):
+                continue
+            offset = index * self.width
+            yield timestamp, self.values[offset:offset + self.width].tolist()
+
+    def dump(self):
+        # Only the used rows, oldest first
+        times = array.array('I')
+        values = array.array('f')
+        start = (self.head - self.count) % self.capacity
+        for i in range(self.count):
+            index = (start + i) % self.capacity
+            times.append(self.times[index])
+            values.extend(self.values[index * self.width:(index + 1) * self.width])
+        return times.tobytes() + values.tobytes()
+
+    def restore(self, times, values):
+        rows = len(times)
+        keep = min(rows, self.capacity)
+        for i in range(rows - keep, rows):
+            self.append(times[i], values[i * self.width:(i + 1) * self.width])
+
+
+class _Rollup:
+    """Running averages of the raw samples in the current bucket"""
+
+    def __init__(self, width):
+        self.bucket = 0
+        self.sums = [0.0] * width
+        self.counts = [0] * width
+
+    def add(self, values):
+        for i, value in enumerate(values):
+            if value is not None and not math.isnan(value):
+                self.sums[i] += value
+                self.counts[i] += 1
+
+    def averages(self):
+        return [s / c if c else None for s, c in zip(self.sums, self.counts)]
+
+    def reset(self, bucket):
+        self.bucket = bucket
+        self.sums = [0.0] * len(self.sums)
+        self.counts = [0] * len(self.counts)
+
+
+class _Series:
+    def __init__(self, width):
+        self.rings = {name: RingBuffer(capacity, width) for name, _, capacity in RESOLUTIONS}
+        self.rollups = {name: _Rollup(width) for name, step, _ in RESOLUTIONS if step}
+
+
+class StatsHistory:
+    """Ring-buffered stats history of every container"""
+
+    def __init__(self, metrics, path=None):
+        self.metrics = tuple(metrics)
+        self.path = path
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, timestamp, values):
+        """Add one sample of `metrics` values (None for unknown)"""
+        timestamp = int(timestamp)
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = _Series(len(self.metrics))
+            series.rings['raw'].append(timestamp, values)
+            for resolution, step, _ in RESOLUTIONS:
+                if not step:
+                    continue
+                rollup = series.rollups[resolution]
+                bucket = timestamp - timestamp % step
+                if bucket != rollup.bucket:
+                    if rollup.bucket and any(rollup.counts):
+                        series.rings[resolution].append(rollup.bucket, rollup.averages())
+                    rollup.reset(bucket)
+                rollup.add(values)
+
+    def discard(self, name):
+        with self._lock:
+            self._series.pop(name, None)
+
+    def names(self):
+        with self._lock:
+            return list(self._series)
+
+    def query(self, name, since, until=None, resolution=None):
+        """Return (resolution, rows) for a time range.
+
+        Without an explicit resolution the finest one whose ring still
+        reaches back to `since` (or has never wrapped) is used. The open
+        rollup bucket is included as the last row so recent data shows up
+        before the bucket closes.
+        """
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                return resolution or 'raw', []
+            if resolution is None:
+                resolution = RESOLUTIONS[-1][0]
+                for candidate, _, _ in RESOLUTIONS:
+                    ring = series.rings[candidate]
+                    oldest = ring.oldest()
+                    if ring.count < ring.capacity or (oldest is not None and oldest <= since):
+                        resolution = candidate
+                        break
+            rows = list(series.rings[resolution].rows(since, until))
+            rollup = series.rollups.get(resolution)
+            if rollup is not None and any(rollup.counts) and rollup.bucket >= since \
+                    and (until is None or rollup.bucket <= until):
+                rows.append((rollup.bucket, rollup.averages()))
+        return resolution, [
+            [timestamp] + [None if v is None or math.isnan(v) else round(v, 2) for v in values]
+            for timestamp, values in rows
+        ]
+
+    # Persistence
+    # Layout: header (magic, version, metric count, container count), then
+    # per container its name, and per resolution the open rollup bucket
+    # (start, sums, counts) followed by the ring rows, oldest first.
+    def save(self, path=None):
+        path = path or self.path
+        width = len(self.metrics)
+        with self._lock:
+            chunks = [MAGIC, struct.pack('<HHI', FORMAT_VERSION, width, len(self._series))]
+            for name, series in self._series.items():
+                encoded = name.encode()
+                chunks.append(struct.pack('<H', len(encoded)) + encoded)
+                for resolution, _, _ in RESOLUTIONS:
+                    rollup = series.rollups.get(resolution) or _Rollup(width)
+                    chunks.append(struct.pack('<I', rollup.bucket))
+                    chunks.append(array.array('d', rollup.sums).tobytes())
+                    chunks.append(array.array('I', rollup.counts).tobytes())
+                    ring = series.rings[resolution]
+                    chunks.append(struct.pack('<I', ring.count))
+                    chunks.append(ring.dump())
+        directory = os.path.dirname(path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.stats-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b''.join(chunks))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def load(self, path=None):
+        """Load a saved history, returns False if the file is missing or unreadable"""
+        path = path or self.path
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        try:
+            series_map = self._decode(data)
+        except (ValueError, struct.error) as e:
+            logger.warning("Ignoring unreadable stats history %s: %s", path, e)
+            return False
+        with self._lock:
+            self._series = series_map
+        return True
+
+    def _decode(self, data):
+        if data[:4] != MAGIC:
+            raise ValueError('bad magic')
+        version, width, containers = struct.unpack_from('<HHI', data, 4)
+        if version != FORMAT_VERSION or width != len(self.metrics):
+            raise ValueError(f'format {version}/{width} not supported')
+        offset = 12
+        series_map = {}
+
+        def take(fmt, count):
+            nonlocal offset
+            values = array.array(fmt)
+            size = values.itemsize * count
+            if offset + size > len(data):
+                raise ValueError('truncated')
+            values.frombytes(data[offset:offset + size])
+            offset += size
+            return values
+
+        for _ in range(containers):
+            (length,) = struct.unpack_from('<H', data, offset)
+            offset += 2
+            name = data[offset:offset + length].decode()
+            offset += length
+            series = _Series(width)
+            for resolution, _, _ in RESOLUTIONS:
+                (bucket,) = struct.unpack_from('<I', data, offset)
+                offset += 4
+                sums = take('d', width).tolist()
+                counts = take('I', width).tolist()
+                if resolution in series.rollups:
+                    rollup = series.rollups[resolution]
+                    rollup.bucket, rollup.sums, rollup.counts = bucket, sums, counts
+                (rows,) = struct.unpack_from('<I', data, offset)
+                offset += 4
+                times = take('I', rows)
+                values = take('f', rows * width)
+                series.rings[resolution].restore(times, values)
+            series_map[name] = series
+        return series_map
@@ -0,0 +1,21 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def load_app(tmp_path, monkeypatch):
+    """Import a fresh app module that keeps its data files under tmp_path"""
+    def load(**env):
+        monkeypatch.chdir(tmp_path)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        sys.modules.pop('app', None)
+        return importlib.import_module('app')
+
+    yield load
+    sys.modules.pop('app', None)
@@ -0,0 +1,281 @@
+"""In-memory LXD API served on a unix socket, for testing LXDClient and the
+app without a running LXD.
+"""
+import http.server
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+
+class _MockLXDHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.mock.lock:
+            self.server.mock.connections.add(self.connection)
+
+    def finish(self):
+        with self.server.mock.lock:
+            self.server.mock.connections.discard(self.connection)
+        super().finish()
+
+    def _send(self, status, body, raw=False):
+        data = body if raw else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream' if raw else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _dispatch(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        server = self.server.mock
+        body = self._body() if self.command in ('POST', 'PUT', 'PATCH') else {}
+        if parts[:2] == ['1.0', 'operations'] and parts[3:] == ['wait'] and server.wait_delay:
+            time.sleep(server.wait_delay)
+        with server.lock:
+            server.requests.append((self.command, url.path, body))
+            if server.hang_up:
+                # Close the connection without answering, as a reset after the request would
+                server.hang_up -= 1
+                self.close_connection = True
+                return
+            if parts[:2] == ['1.0', 'operations'] and len(parts) >= 3:
+                operation = server.operations.get(parts[2])
+                if operation is None:
+                    return self._send(404, server.error('Operation not found', 404))
+                return self._send(200, server.sync(operation))
+            if parts[:2] == ['1.0', 'logs']:
+                if self.command == 'DELETE':
+                    server.logs.pop(parts[2], None)
+                    return self._send(200, server.sync({}))
+                if parts[2] not in server.logs:
+                    return self._send(404, server.error('Log not found', 404))
+                return self._send(200, server.logs[parts[2]].encode(), raw=True)
+            if parts == ['1.0', 'instances'] and self.command == 'GET':
+                names = sorted(server.instances)
+                if url.query == 'recursion=2':
+                    return self._send(200, server.sync([server.instance_full(n) for n in names]))
+                return self._send(200, server.sync([f"/1.0/instances/{n}" for n in names]))
+            if parts[:3] == ['1.0', 'images', 'aliases'] and len(parts) == 4:
+                if parts[3] not in server.aliases:
+                    return self._send(404, server.error('Image alias not found', 404))
+                return self._send(200, server.sync({'name': parts[3], 'target': server.aliases[parts[3]]}))
+            if parts == ['1.0', 'images'] and self.command == 'POST':
+                fingerprint = uuid.uuid4().hex
+                server.images[fingerprint] = {'fingerprint': fingerprint, 'size': 123456789,
+                                              'uploaded_at': '2026-01-01T00:00:00Z',
+                                              'source': body.get('source')}
+                for alias in body.get('aliases', []):
+                    server.aliases[alias['name']] = fingerprint
+                return self._send(202, server.async_operation({}))
+            if parts[:2] == ['1.0', 'images'] and len(parts) >= 3:
+                if parts[2] not in server.images:
+                    return self._send(404, server.error('Image not found', 404))
+                if parts[3:] == ['refresh'] and self.command == 'POST':
+                    return self._send(202, server.async_operation({'refreshed': False}))
+                return self._send(200, server.sync(server.images[parts[2]]))
+            if parts[:2] == ['1.0', 'storage-pools'] and len(parts) == 3:
+                return self._send(200, server.sync({'name': parts[2], 'driver': server.storage_driver,
+                                                    'config': server.storage_config}))
+            if parts == ['1.0', 'instances'] and self.command == 'POST':
+                if body.get('name') in server.instances:
+                    return self._send(409, server.error('Instance already exists', 409))
+                server.add_instance(body['name'], status='Running' if body.get('start') else 'Stopped',
+                                    config=body.get('config'), devices=body.get('devices'))
+                server.instances[body['name']]['source'] = body.get('source')
+                return self._send(202, server.async_operation({}))
+            if parts[:2] != ['1.0', 'instances'] or len(parts) < 3:
+                return self._send(404, server.error('Not found', 404))
+            name = parts[2]
+            instance = server.instances.get(name)
+            if instance is None:
+                return self._send(404, server.error('Instance not found', 404))
+            sub = parts[3] if len(parts) > 3 else None
+            if sub is None and self.command == 'GET':
+                metadata = server.instance_full(name)
+                del metadata['state']
+                return self._send(200, server.sync(metadata))
+            if sub is None and self.command == 'PATCH':
+                instance['config'].update(body.get('config', {}))
+                instance['devices'].update(body.get('devices', {}))
+                return self._send(200, server.sync({}))
+            if sub is None and self.command == 'DELETE':
+                if instance['status'] == 'Running':
+                    return self._send(400, server.error('Instance is running', 400))
+                del server.instances[name]
+                return self._send(202, server.async_operation({}))
+            if sub is None and self.command == 'POST':
+                if instance['status'] == 'Running':
+                    return self._send(400, server.error('Renaming of running instance not allowed', 400))
+                if body.get('name') in server.instances:
+                    return self._send(409, server.error('Name already in use', 409))
+                server.instances[body['name']] = server.instances.pop(name)
+                return self._send(202, server.async_operation({}))
+            if sub is None and self.command == 'PUT' and 'restore' in body:
+                snapshot = instance['snapshots'].get(body['restore'])
+                if snapshot is None:
+                    return self._send(404, server.error('Snapshot not found', 404))
+                if instance['status'] == 'Running':
+                    return self._send(400, server.error('Instance is running', 400))
+                instance['config'] = dict(snapshot['config'])
+                instance['devices'] = json.loads(json.dumps(snapshot['devices']))
+                return self._send(202, server.async_operation({}))
+            if sub == 'snapshots' and self.command == 'GET':
+                return self._send(200, server.sync(
+                    [f"/1.0/instances/{name}/snapshots/{s}" for s in sorted(instance['snapshots'])]))
+            if sub == 'snapshots' and self.command == 'POST':
+                instance['snapshots'][body['name']] = {
+                    'config': dict(instance['config']),
+                    'devices': json.loads(json.dumps(instance['devices']))
+                }
+                return self._send(202, server.async_operation({}))
+            if sub == 'state' and self.command == 'GET':
+                return self._send(200, server.sync(server.instance_state(name)))
+            if sub == 'state' and self.command == 'PUT':
+                instance['status'] = {'start': 'Running', 'restart': 'Running'}.get(
+                    body.get('action'), 'Stopped')
+                return self._send(202, server.async_operation({}))
+            if sub == 'exec' and self.command == 'POST':
+                code, stdout, stderr = server.exec_handler(name, body.get('command', []))
+                outputs = {}
+                for fd, text in (('1', stdout), ('2', stderr)):
+                    log_id = f"exec_{uuid.uuid4().hex}.{'stdout' if fd == '1' else 'stderr'}"
+                    server.logs[log_id] = text
+                    outputs[fd] = f"/1.0/logs/{log_id}"
+                return self._send(202, server.async_operation(
+                    {'return': code, 'output': outputs}))
+            return self._send(400, server.error('Unsupported request', 400))
+
+    do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = _dispatch
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MockLXDServer:
+    """In-memory LXD API served on a unix socket.
+
+    Usage:
+        server = MockLXDServer('/tmp/lxd.sock', instances={'c1': {}})
+        server.start()
+        client = LXDClient('/tmp/lxd.sock')
+        ...
+        server.stop()
+
+    `wait_delay` holds every operation wait for that many seconds, like a
+    slow operation would, and drop_connections() closes the kept-alive
+    connections as an LXD restart would. The next `hang_up` requests are
+    read and recorded, then their connection is closed without a response.
+    """
+
+    def __init__(self, socket_path, instances=None, exec_handler=None, storage_driver='dir',
+                 storage_config=None, wait_delay=0):
+        self.socket_path = socket_path
+        self.storage_driver = storage_driver
+        self.storage_config = dict(storage_config or {})
+        self.wait_delay = wait_delay
+        self.hang_up = 0
+        self.instances = {}
+        for name, instance in (instances or {}).items():
+            self.add_instance(name, **instance)
+        self.exec_handler = exec_handler or (lambda name, command: (0, '', ''))
+        self.images = {}
+        self.aliases = {}
+        self.operations = {}
+        self.logs = {}
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def add_instance(self, name, status='Stopped', config=None, devices=None, state=None):
+        self.instances[name] = {
+            'status': status,
+            'config': dict(config or {}),
+            'devices': dict(devices or {}),
+            'state': dict(state or {}),
+            'snapshots': {}
+        }
+
+    def instance_state(self, name):
+        instance = self.instances[name]
+        return dict(instance['state'], status=instance['status'])
+
+    def instance_full(self, name):
+        instance = self.instances[name]
+        return {
+            'name': name,
+            'status': instance['status'],
+            'config': instance['config'],
+            'devices': instance['devices'],
+            'state': self.instance_state(name)
+        }
+
+    @staticmethod
+    def sync(metadata):
+        return {'type': 'sync', 'status': 'Success', 'status_code': 200, 'metadata': metadata}
+
+    @staticmethod
+    def error(message, code):
+        return {'type': 'error', 'error': message, 'error_code': code}
+
+    def async_operation(self, metadata):
+        operation_id = uuid.uuid4().hex
+        self.operations[operation_id] = {
+            'id': operation_id,
+            'status': 'Success',
+            'status_code': 200,
+            'metadata': metadata,
+            'err': ''
+        }
+        return {
+            'type': 'async',
+            'status': 'Operation created',
+            'status_code': 100,
+            'operation': f"/1.0/operations/{operation_id}",
+            'metadata': self.operations[operation_id]
+        }
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = _UnixHTTPServer(self.socket_path, _MockLXDHandler)
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def drop_connections(self):
+        """Close the server side of every open client connection"""
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
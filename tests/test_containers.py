@@ -0,0 +1,52 @@
+"""Container operations of the app against MockLXDServer"""
+import pytest
+
+from mock_lxd import MockLXDServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = MockLXDServer(str(tmp_path / 'lxd.sock'), instances={'c1': {'status': 'Running'}})
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def app(load_app, server):
+    app = load_app(LXD_SOCKET=server.socket_path, LXD_API_ENABLED='true')
+    yield app
+    app.lxd.close()
+
+
+def test_delete_stops_running_container(app, server):
+    app.lxc_delete('c1')
+    assert 'c1' not in server.instances
+    assert [r[0] for r in server.requests if r[1] == '/1.0/instances/c1'] == ['DELETE']
+
+
+def test_discard_missing_container(app, server):
+    app.discard_container('missing')
+    assert 'c1' in server.instances
+
+
+def test_zfs_snapshots_need_refquota(app, server):
+    server.storage_driver = 'zfs'
+    assert not app.pristine_snapshots_enabled()
+    app._storage_pools.clear()
+    server.storage_config['volume.zfs.use_refquota'] = 'true'
+    assert app.pristine_snapshots_enabled()
+
+
+@pytest.mark.parametrize('storage_config', [{}, {'volume.zfs.use_refquota': 'true'}])
+def test_reinstall_keeps_suspended_vps_stopped(app, server, storage_config):
+    server.storage_driver = 'zfs'
+    server.storage_config.update(storage_config)
+    app.provision_container('v1', 'ubuntu2204', 1024, 1, 10)
+    app.add_vps('admin', {'container_name': 'v1', 'ram_mb': 1024, 'cpu': 1, 'disk_gb': 10,
+                          'os': 'ubuntu2204', 'status': 'suspended', 'suspended': True})
+    app.lxc_set_state('v1', 'stop')
+    result = app._job_reinstall_vps('job', 'v1', 'ubuntu2204')
+    assert result['source'] == ('snapshot' if storage_config else 'image')
+    assert server.instances['v1']['status'] == 'Stopped'
+    assert app.find_vps('v1')[1]['status'] == 'suspended'
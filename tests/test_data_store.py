@@ -0,0 +1,75 @@
+"""Data cache and storage backends"""
+import os
+
+import pytest
+
+
+def new_vps(name, status='stopped'):
+    return {'container_name': name, 'ram_mb': 1024, 'cpu': 1, 'disk_gb': 10, 'status': status}
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def app(request, load_app):
+    return load_app(STORAGE_BACKEND=request.param)
+
+
+def test_readers_survive_concurrent_writes(app):
+    users = app.load_users()
+    for n, _ in enumerate(users.items()):
+        # Used to raise "dictionary changed size during iteration"
+        app.add_user(f"user{n}", {'email': f"user{n}@example.com", 'role': 'user'})
+        app.update_user('admin', balance=n + 1.0)
+    assert list(users) == ['admin']
+    assert users['admin']['balance'] == 0.0
+    assert app.load_users()['admin']['balance'] == 1.0
+    assert app.find_user_by_email('user0@example.com') == 'user0'
+
+
+def test_failed_transaction_leaves_cache_unchanged(app):
+    with pytest.raises(RuntimeError):
+        with app.data_transaction(app.USERS_FILE):
+            users = app.load_users()
+            users['admin']['balance'] = 99.0
+            users.pop('admin')
+            raise RuntimeError('boom')
+    assert app.load_users()['admin']['balance'] == 0.0
+
+
+def test_transaction_save_is_published(app):
+    with app.data_transaction(app.USERS_FILE):
+        users = app.load_users()
+        users['admin']['balance'] = 5.0
+        app.save_users(users)
+    assert app.load_users()['admin']['balance'] == 5.0
+    assert app.get_auth_state('admin')['role'] == 'admin'
+
+
+def test_single_record_vps_changes_copy_on_write(app):
+    app.add_vps('bob', new_vps('c1'))
+    before = app.load_vps_data()
+    app.update_vps('c1', status='running')
+    app.add_vps('bob', new_vps('c2'))
+    assert before == {'bob': [new_vps('c1')]}
+    assert app.find_vps('c1')[1]['status'] == 'running'
+    assert app.get_vps_totals('bob')['vps'] == 2
+    assert app.get_vps_totals()['running'] == 1
+    app.remove_vps('c1')
+    assert app.get_user_containers('bob') == ['c2']
+
+
+def test_changes_survive_reload(app):
+    app.add_vps('bob', new_vps('c1'))
+    app.update_vps('c1', status='running')
+    app.update_user('admin', balance=3.0)
+    app._data_cache.clear()
+    assert app.find_vps('c1')[1]['status'] == 'running'
+    assert app.load_users()['admin']['balance'] == 3.0
+
+
+def test_sqlite_import_includes_journaled_changes(load_app):
+    app = load_app(STORAGE_BACKEND='json')
+    app.add_vps('bob', new_vps('c1'))
+    app.update_vps('c1', status='running')
+    assert os.path.exists(app.VPS_JOURNAL_FILE)
+    app = load_app(STORAGE_BACKEND='sqlite')
+    assert app.find_vps('c1') == ('bob', new_vps('c1', status='running'))
@@ -0,0 +1,91 @@
+"""Round trips between LXDClient and MockLXDServer"""
+import pytest
+
+from lxd_client import LXDClient, LXDError
+from mock_lxd import MockLXDServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = MockLXDServer(str(tmp_path / 'lxd.sock'), instances={'c1': {'status': 'Stopped'}})
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server):
+    client = LXDClient(server.socket_path, timeout=5)
+    yield client
+    client.close()
+
+
+def test_sync_request(server, client):
+    assert client.status('c1') == 'Stopped'
+    assert server.requests[-1][:2] == ('GET', '/1.0/instances/c1/state')
+
+
+def test_error_response(client):
+    with pytest.raises(LXDError) as error:
+        client.state('missing')
+    assert error.value.status_code == 404
+
+
+def test_async_operation_wait(server, client):
+    client.start('c1')
+    assert server.instances['c1']['status'] == 'Running'
+    method, path, _ = server.requests[-1]
+    assert method == 'GET' and path.startswith('/1.0/operations/') and path.endswith('/wait')
+
+
+def test_keep_alive_connection_is_reused(server, client):
+    client.status('c1')
+    sock = client._connection().sock
+    client.status('c1')
+    assert client._connection().sock is sock
+    assert len(server.connections) == 1
+
+
+def test_reconnect_after_dropped_keep_alive(server, client):
+    client.status('c1')
+    sock = client._connection().sock
+    server.drop_connections()
+    assert client.status('c1') == 'Stopped'
+    assert client._connection().sock is not sock
+
+
+def test_wait_outlasts_socket_timeout(server):
+    server.wait_delay = 1
+    client = LXDClient(server.socket_path, timeout=0.5)
+    try:
+        client.start('c1')
+        assert server.instances['c1']['status'] == 'Running'
+        # The longer timeout only applied to the wait itself
+        assert client._connection().sock.gettimeout() == 0.5
+    finally:
+        client.close()
+
+
+def test_idempotent_request_is_retried_after_reset(server, client):
+    client.status('c1')
+    server.hang_up = 1
+    assert client.status('c1') == 'Stopped'
+    assert [r[:2] for r in server.requests[-2:]] == [('GET', '/1.0/instances/c1/state')] * 2
+
+
+def test_sent_post_is_not_retried_after_reset(server, client):
+    client.status('c1')
+    server.hang_up = 1
+    with pytest.raises(ConnectionError):
+        client.rename('c1', 'c2')
+    assert [r[0] for r in server.requests].count('POST') == 1
+    assert 'c1' in server.instances
+
+
+def test_delete(server, client):
+    server.instances['c1']['status'] = 'Running'
+    with pytest.raises(LXDError):
+        client.delete('c1')
+    client.stop('c1')
+    client.delete('c1')
+    assert 'c1' not in server.instances
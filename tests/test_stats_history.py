@@ -0,0 +1,48 @@
+"""StatsHistory rings, rollups and the binary file they are saved to"""
+import pytest
+
+from stats_history import RESOLUTIONS, StatsHistory
+
+METRICS = ('cpu', 'memory_mb', 'disk_gb')
+START = 1700000000 - 1700000000 % 3600
+
+
+@pytest.fixture
+def history():
+    history = StatsHistory(METRICS)
+    # Three hours of samples every 10s, wrapping the raw ring; None is unknown
+    for i in range(3 * 360):
+        history.record('c1', START + i * 10, [i % 100, 512.0, None if i % 7 == 0 else 2.5])
+    history.record('c2', START, [1.0, 2.0, 3.0])
+    return history
+
+
+def test_save_load_round_trip(history, tmp_path):
+    path = str(tmp_path / 'stats_history.bin')
+    history.save(path)
+    loaded = StatsHistory(METRICS)
+    assert loaded.load(path)
+    assert sorted(loaded.names()) == ['c1', 'c2']
+    for name in ('c1', 'c2'):
+        for resolution, _, _ in RESOLUTIONS:
+            assert loaded.query(name, 0, resolution=resolution) == \
+                history.query(name, 0, resolution=resolution)
+    # The open rollup buckets were saved too and keep accumulating
+    for history_ in (history, loaded):
+        history_.record('c1', START + 3 * 3600, [50.0, 512.0, 2.5])
+    assert loaded.query('c1', 0, resolution='1h') == history.query('c1', 0, resolution='1h')
+
+
+def test_query_picks_finest_covering_resolution(history):
+    end = START + 3 * 3600
+    assert history.query('c1', end - 600)[0] == 'raw'
+    assert history.query('c1', START)[0] == '1m'
+    resolution, rows = history.query('c1', START, resolution='1h')
+    assert resolution == '1h' and [row[0] for row in rows] == [START + h * 3600 for h in range(3)]
+
+
+def test_load_rejects_other_metrics(history, tmp_path):
+    path = str(tmp_path / 'stats_history.bin')
+    history.save(path)
+    assert not StatsHistory(METRICS[:2]).load(path)
+    assert not StatsHistory(METRICS).load(str(tmp_path / 'missing.bin'))